@@ -1,9 +1,11 @@
+import multiprocessing
+import os
+import sys
 import time
-from concurrent.futures import ThreadPoolExecutor
-from itertools import chain
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, as_completed, wait
 from math import atan2, degrees
 from pathlib import Path
-from typing import Tuple, Union, List
+from typing import Iterator, List, Optional, Tuple, Union
 
 import cv2
 import mediapipe as mp
@@ -12,11 +14,17 @@ from mediapipe.tasks.python.components.containers.bounding_box import BoundingBo
 from mediapipe.tasks.python.components.containers.keypoint import NormalizedKeypoint
 from mediapipe.tasks.python.vision.face_detector import FaceDetectorResult
 
+# face_detection_cache.py is shared with the image stages in vi_database_construction/b_construction_and_statistics
+sys.path.append(str(Path(__file__).resolve().parents[2] / 'vi_database_construction' / 'b_construction_and_statistics'))
+from face_detection_cache import FaceDetectionCache, get_detector_key, hash_bytes  # noqa: E402
+
 BaseOptions = mp.tasks.BaseOptions
 FaceDetector = mp.tasks.vision.FaceDetector
 FaceDetectorOptions = mp.tasks.vision.FaceDetectorOptions
 VisionRunningMode = mp.tasks.vision.RunningMode
 
+IMAGE_SUFFIXES = {'.png', '.jpg', '.jpeg', '.tiff'}
+
 
 def draw_keypoints(image: np.ndarray,
                    right_eye_tragion: Tuple[int, int],
@@ -103,12 +111,23 @@ def occlude_image(input_dir: Path,
                   output_dir: Path,
                   keypoint_detector: FaceDetector,
                   crop: bool,
-                  debug: bool) -> None:
-    np_image = cv2.imread(str(image_path))
+                  debug: bool,
+                  detection_cache: Optional[FaceDetectionCache] = None) -> bool:
+    """
+    Occludes a single image and returns whether a face was detected.
+    If a detection_cache is given, the detection result is looked up by the image's content and only computed on a miss.
+    """
+    data = image_path.read_bytes()
+    np_image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if np_image is None:
+        raise ValueError(f'Could not read image {image_path}')
     mp_image = mp.Image(image_format=mp.ImageFormat.SRGB, data=np_image)
     h, w, _ = np_image.shape
 
-    detection_result = keypoint_detector.detect(mp_image)
+    if detection_cache is None:
+        detection_result = keypoint_detector.detect(mp_image)
+    else:
+        detection_result = detection_cache.get_or_detect(hash_bytes(data), lambda: keypoint_detector.detect(mp_image))
     bounding_box, keypoints = find_plausibel_face_detector_result(detection_result)
 
     if keypoints is None:
@@ -116,7 +135,7 @@ def occlude_image(input_dir: Path,
         print(f'Could not detect face for {image_path}')
         output_error_path.parent.mkdir(parents=True, exist_ok=True)
         cv2.imwrite(str(output_error_path), np_image)
-        return
+        return False
 
     right_eye_tragion = to_pixel_space(keypoints[4], w, h)
     right_eye = to_pixel_space(keypoints[1], w, h)
@@ -134,32 +153,126 @@ def occlude_image(input_dir: Path,
     output_path = output_dir / image_path.relative_to(input_dir)
     output_path.parent.mkdir(parents=True, exist_ok=True)
     cv2.imwrite(str(output_path), output_image)
+    return True
 
 
-def main(input_dir: Path, output_dir: Path, keypoint_detector: FaceDetector, crop: bool = False, debug: bool = False) -> None:
-    image_paths = list(chain(
-        input_dir.rglob('*.png'),
-        input_dir.rglob('*.PNG'),
-        input_dir.rglob('*.jpg'),
-        input_dir.rglob('*.JPG'),
-        input_dir.rglob('*.jpeg'),
-        input_dir.rglob('*.JPEG'),
-        input_dir.rglob('*.tiff'),
-        input_dir.rglob('*.TIFF')
-    ))
-    number_of_images = len(image_paths)
+def create_keypoint_detector(model_path: str, min_detection_confidence: float) -> FaceDetector:
+    options = FaceDetectorOptions(
+        base_options=BaseOptions(model_asset_path=model_path),
+        running_mode=VisionRunningMode.IMAGE,
+        min_detection_confidence=min_detection_confidence)
+    return FaceDetector.create_from_options(options)
+
+
+def open_detection_cache(detection_cache_path: Optional[Path],
+                         model_path: str,
+                         min_detection_confidence: float) -> Optional[FaceDetectionCache]:
+    if detection_cache_path is None:
+        return None
+    detector_key = get_detector_key(model_path, min_detection_confidence=min_detection_confidence)
+    return FaceDetectionCache(detection_cache_path, detector_key)
+
+
+# A FaceDetector must not be shared between concurrently running tasks.
+# Therefore, each worker process creates its own detector (and detection cache connection) once in init_worker.
+worker_keypoint_detector = None
+worker_detection_cache = None
+
+
+def init_worker(model_path: str, min_detection_confidence: float, detection_cache_path: Optional[Path] = None) -> None:
+    global worker_keypoint_detector, worker_detection_cache
+    worker_keypoint_detector = create_keypoint_detector(model_path, min_detection_confidence)
+    worker_detection_cache = open_detection_cache(detection_cache_path, model_path, min_detection_confidence)
+
+
+def occlude_image_in_worker(input_dir: Path, image_path: Path, output_dir: Path, crop: bool, debug: bool) -> bool:
+    return occlude_image(input_dir, image_path, output_dir, worker_keypoint_detector, crop, debug,
+                         worker_detection_cache)
+
+
+def find_image_paths(input_dir: Path) -> Iterator[Path]:
+    """Lazily yields all images below input_dir in a single pass over the directory tree."""
+    for dir_path, _, file_names in os.walk(input_dir):
+        for file_name in file_names:
+            if os.path.splitext(file_name)[1].lower() in IMAGE_SUFFIXES:
+                yield Path(dir_path) / file_name
+
+
+def main(input_dir: Path,
+         output_dir: Path,
+         model_path: str,
+         min_detection_confidence: float = 0.4,
+         crop: bool = False,
+         debug: bool = False,
+         workers: Optional[int] = None,
+         max_in_flight: Optional[int] = None,
+         detection_cache_path: Optional[Path] = None) -> None:
+    """
+    Occludes all images below input_dir.
+    With workers=1, all images are processed in this process by a single FaceDetector.
+    Otherwise, a process pool with one FaceDetector per worker process is used.
+    At most max_in_flight images are submitted to the pool at any time, so memory stays constant
+    regardless of the number of images. Exceptions of single images are reported and counted, not dropped.
+    If detection_cache_path is given, face detections are cached there (see face_detection_cache.py),
+    so re-runs with, e.g., crop=True only pay for the occlusion itself.
+    """
+    workers = workers or os.cpu_count()
+    max_in_flight = max_in_flight or 4 * workers
+    number_of_images = 0
+    number_of_faces = 0
+    failures = []
+
+    def collect(image_path: Path, future: Future) -> None:
+        nonlocal number_of_faces
+        try:
+            number_of_faces += future.result()
+        except Exception as e:
+            failures.append(image_path)
+            print(f'Failed to process {image_path}: {e!r}')
 
     start_time = time.time()
-    print(f'Starting to process {number_of_images} image files...')
-
-    with ThreadPoolExecutor() as executor:
-        for i, image_path in enumerate(image_paths):
-            if i % 1000 == 0:
-                print(f'Starting to process image {i} of {number_of_images} images...')
-            executor.submit(occlude_image, input_dir, image_path, output_dir, keypoint_detector, crop, debug)
-
-    end_time = time.time()
-    print(f'Processed {number_of_images} images in  {(end_time - start_time):.2f} seconds')
+    print(f'Starting to process image files with {workers} worker(s)...')
+
+    if workers == 1:
+        detection_cache = open_detection_cache(detection_cache_path, model_path, min_detection_confidence)
+        with create_keypoint_detector(model_path, min_detection_confidence) as keypoint_detector:
+            for image_path in find_image_paths(input_dir):
+                if number_of_images % 1000 == 0:
+                    print(f'Starting to process image {number_of_images}...')
+                number_of_images += 1
+                try:
+                    number_of_faces += occlude_image(input_dir, image_path, output_dir, keypoint_detector, crop, debug,
+                                                     detection_cache)
+                except Exception as e:
+                    failures.append(image_path)
+                    print(f'Failed to process {image_path}: {e!r}')
+    else:
+        # MediaPipe is not fork-safe once it has been initialized in the parent process, so the workers are spawned
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                 initializer=init_worker, initargs=(model_path, min_detection_confidence, detection_cache_path)) as executor:
+            in_flight = {}
+            for image_path in find_image_paths(input_dir):
+                if number_of_images % 1000 == 0:
+                    print(f'Starting to process image {number_of_images}...')
+                number_of_images += 1
+
+                if len(in_flight) >= max_in_flight:
+                    done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        collect(in_flight.pop(future), future)
+
+                future = executor.submit(occlude_image_in_worker, input_dir, image_path, output_dir, crop, debug)
+                in_flight[future] = image_path
+
+            for future in as_completed(in_flight):
+                collect(in_flight[future], future)
+
+    elapsed_time = time.time() - start_time
+    print(f'Processed {number_of_images} images in {elapsed_time:.2f} seconds '
+          f'({number_of_images / max(elapsed_time, 1e-9):.2f} images/sec)')
+    print(f'Detected faces in {number_of_faces} images, '
+          f'no face in {number_of_images - number_of_faces - len(failures)} images, '
+          f'{len(failures)} images failed')
 
 
 if __name__ == '__main__':
@@ -171,9 +284,6 @@ if __name__ == '__main__':
     debug = False
 
     model_path = 'blaze_face_short_range.tflite'
-    options = FaceDetectorOptions(
-        base_options=BaseOptions(model_asset_path=model_path),
-        running_mode=VisionRunningMode.IMAGE,
-        min_detection_confidence=0.4)
-    with FaceDetector.create_from_options(options) as keypoint_detector:
-        main(input_dir, output_dir, keypoint_detector, crop, debug)
+    detection_cache_path = input_dir.with_name('face-detection-cache.sqlite')
+    main(input_dir, output_dir, model_path, min_detection_confidence=0.4, crop=crop, debug=debug,
+         detection_cache_path=detection_cache_path)
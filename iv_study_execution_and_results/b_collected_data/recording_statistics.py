@@ -0,0 +1,148 @@
+import csv
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from statistics import mean, pstdev
+
+import numpy as np
+
+# recording_window.py and face_expressions_per_second.py both derive their statistics from facial-recordings:
+#
+# facial-recordings
+# ├── <participant-id>
+#     ├── faceexpressions.csv
+#     ├── Level <level-id>
+#         ├── <emoji-id>-<emotion-name>
+#             ├── <timestamp>.png
+#             ├── <timestamp>-1.png
+#
+# scan_facial_recordings collects everything both scripts need in a single pass over this structure,
+# one participant per worker process, and create_report condenses it into a JSON-serializable report.
+
+LEVELS = ['Level 1', 'Level 2', 'Level 3', 'Level 4']
+# The versions of the cache of vi_database_construction/b_construction_and_statistics/fea_recordings.py
+# (its CACHE_VERSION) whose timestamps.npy, levels.npy and level_names this script can read.
+# Caches of any other version are ignored, i.e., the csv is parsed instead.
+SUPPORTED_FEA_CACHE_VERSIONS = (1, 2, 3)
+
+
+def read_fea_timestamps(csv_file_path):
+    """
+    Returns the timestamps (int64) and level names of a faceexpressions.csv as arrays.
+    If the csv was already converted by vi_database_construction/b_construction_and_statistics/fea_recordings.py
+    and the cache is still up to date, the cached columns are memory-mapped instead of parsing the csv again.
+    """
+    cache_dir = csv_file_path.with_name(f'{csv_file_path.stem}-cache')
+    meta_path = cache_dir / 'meta.json'
+    if meta_path.exists():
+        with open(meta_path, mode='r', encoding='utf-8') as meta_file:
+            meta = json.load(meta_file)
+        source = meta.get('source', {})
+        stat = csv_file_path.stat()
+        if (source.get('version') in SUPPORTED_FEA_CACHE_VERSIONS
+                and source == {'version': source['version'], 'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}):
+            timestamps = np.load(cache_dir / 'timestamps.npy', mmap_mode='r')
+            levels = np.load(cache_dir / 'levels.npy', mmap_mode='r')
+            return np.asarray(timestamps), np.asarray(meta['level_names'])[levels]
+
+    timestamps = []
+    levels = []
+    with open(csv_file_path, mode='r', encoding='utf-8') as file:
+        reader = csv.reader(file, delimiter=';')
+        for row in reader:
+            if row:
+                timestamp, level, _, _, _ = row
+                timestamps.append(int(timestamp))
+                levels.append(level)
+    return np.array(timestamps, dtype=np.int64), np.array(levels)
+
+
+def scan_participant(participant_path: str) -> dict:
+    """
+    Scans a single participant's directory and returns
+    the (level, window duration, number of central-view images) of every emoji directory and
+    the (number of timestamps, first timestamp, last timestamp) of the FEAs per level.
+    """
+    emoji_dirs = []
+    with os.scandir(participant_path) as level_entries:
+        for level_entry in level_entries:
+            if level_entry.name not in LEVELS or not level_entry.is_dir():
+                continue
+            with os.scandir(level_entry.path) as emoji_entries:
+                for emoji_entry in emoji_entries:
+                    if not emoji_entry.is_dir():
+                        continue
+                    with os.scandir(emoji_entry.path) as file_entries:
+                        # Only the central-view images, i.e., <timestamp>.png, but not <timestamp>-1.png
+                        timestamps = [int(file_entry.name[:-4]) for file_entry in file_entries
+                                      if file_entry.name.endswith('.png') and '-' not in file_entry.name]
+                    emoji_dirs.append((level_entry.name, max(timestamps) - min(timestamps), len(timestamps)))
+
+    fea_levels = {}
+    csv_file_path = Path(participant_path) / 'faceexpressions.csv'
+    if csv_file_path.exists():
+        timestamps, levels = read_fea_timestamps(csv_file_path)
+        for level in LEVELS:
+            level_timestamps = timestamps[levels == level]
+            if len(level_timestamps):
+                fea_levels[level] = (len(level_timestamps), int(level_timestamps.min()), int(level_timestamps.max()))
+
+    return {'participant': os.path.basename(participant_path), 'emoji_dirs': emoji_dirs, 'fea_levels': fea_levels}
+
+
+def scan_facial_recordings(base_path, workers=None) -> list:
+    with os.scandir(base_path) as participant_entries:
+        participant_paths = sorted(entry.path for entry in participant_entries if entry.is_dir())
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(scan_participant, participant_paths))
+
+
+def describe(values) -> dict:
+    return {'mean': mean(values), 'max': max(values), 'min': min(values), 'std': pstdev(values)}
+
+
+def create_report(participants) -> dict:
+    """Condenses the results of scan_facial_recordings into per-level statistics."""
+    window_durations = {level: [] for level in LEVELS}
+    file_counts = {level: [] for level in LEVELS}
+    fea_counts = {level: 0 for level in LEVELS}
+    fea_durations = {level: 0 for level in LEVELS}
+    for participant in participants:
+        for level, window_duration, file_count in participant['emoji_dirs']:
+            window_durations[level].append(window_duration)
+            file_counts[level].append(file_count)
+        for level, (count, first_timestamp, last_timestamp) in participant['fea_levels'].items():
+            fea_counts[level] += count
+            fea_durations[level] += last_timestamp - first_timestamp
+
+    levels = {}
+    for level in LEVELS:
+        levels[level] = {
+            'window_duration_ms': describe(window_durations[level]) if window_durations[level] else None,
+            'images_per_window': describe(file_counts[level]) if file_counts[level] else None,
+            'fea_timestamps': fea_counts[level],
+            'fea_duration_ms': fea_durations[level],
+            'fea_timestamps_per_second': 1000 * fea_counts[level] / fea_durations[level] if fea_durations[level] else None,
+        }
+
+    total_fea_timestamps = sum(fea_counts.values())
+    total_fea_duration = sum(fea_durations.values())
+    return {
+        'participants': len(participants),
+        'levels': levels,
+        'total_images': sum(sum(counts) for counts in file_counts.values()),
+        'total_fea_timestamps': total_fea_timestamps,
+        'total_fea_duration_ms': total_fea_duration,
+        # Equals the average of the per-participant and per-level frequencies weighted by their durations
+        'fea_timestamps_per_second': 1000 * total_fea_timestamps / total_fea_duration if total_fea_duration else None,
+    }
+
+
+if __name__ == '__main__':
+    base_path = Path('facial-recordings')
+    report = create_report(scan_facial_recordings(base_path))
+    report_path = base_path.parent / 'recording_statistics.json'
+    with open(report_path, mode='w', encoding='utf-8') as report_file:
+        json.dump(report, report_file, indent=2)
+    print(f'Saved report to {report_path}')
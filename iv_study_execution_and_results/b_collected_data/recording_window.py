@@ -1,35 +1,25 @@
 from pathlib import Path
-from statistics import mean, pstdev
 
+from recording_statistics import create_report, scan_facial_recordings
 
-def calculate_average_max_timestamp_difference(base_path):
-    level_max_diffs = {'Level 1': [], 'Level 2': [], 'Level 3': [], 'Level 4': []}
-    level_file_counts = {'Level 1': [], 'Level 2': [], 'Level 3': [], 'Level 4': []}
 
-    for participant_dir in base_path.iterdir():
-        if participant_dir.is_dir():
-            for level_dir in participant_dir.iterdir():
-                if level_dir.is_dir() and level_dir.name in level_max_diffs:
-                    for emoji_dir in level_dir.iterdir():
-                        if emoji_dir.is_dir():
-                            timestamps = [int(image_path.stem) for image_path in emoji_dir.iterdir() if
-                                          image_path.suffix == '.png' and '-' not in image_path.stem]
-                            max_difference = max(timestamps) - min(timestamps)
-                            level_max_diffs[level_dir.name].append(max_difference)
-                            level_file_counts[level_dir.name].append(len(timestamps))
+def calculate_average_max_timestamp_difference(base_path):
+    report = create_report(scan_facial_recordings(base_path))
 
-    for level, max_diffs in level_max_diffs.items():
-        print(f'\n{level}: Mean of max differences {int(mean(max_diffs))} Milliseconds')
-        print(f'{level}: Max of max differences {max(max_diffs)} Milliseconds')
-        print(f'{level}: Min of max differences {min(max_diffs)} Milliseconds')
+    for level, level_report in report['levels'].items():
+        max_diffs = level_report['window_duration_ms']
+        file_counts = level_report['images_per_window']
+        print(f'\n{level}: Mean of max differences {int(max_diffs["mean"])} Milliseconds')
+        print(f'{level}: Max of max differences {max_diffs["max"]} Milliseconds')
+        print(f'{level}: Min of max differences {max_diffs["min"]} Milliseconds')
 
-        print(f'{level}: Standard Deviation of max differences {int(pstdev(max_diffs))} Milliseconds')
-        print(f'{level}: Average number of files = {round(mean(level_file_counts[level]), 2)} Images')
-        print(f'{level}: Max number of files = {max(level_file_counts[level])} Images')
-        print(f'{level}: Min number of files = {min(level_file_counts[level])} Images')
-        print(f'{level}: Standard Deviation of number of files {round(pstdev(level_file_counts[level]), 2)} Images')
+        print(f'{level}: Standard Deviation of max differences {int(max_diffs["std"])} Milliseconds')
+        print(f'{level}: Average number of files = {round(file_counts["mean"], 2)} Images')
+        print(f'{level}: Max number of files = {file_counts["max"]} Images')
+        print(f'{level}: Min number of files = {file_counts["min"]} Images')
+        print(f'{level}: Standard Deviation of number of files {round(file_counts["std"], 2)} Images')
 
-    print(f'\nTotal number of files: {sum(sum(file_counts) for file_counts in level_file_counts.values())}')
+    print(f'\nTotal number of files: {report["total_images"]}')
 
 
 if __name__ == '__main__':
@@ -1,19 +1,52 @@
 import argparse
 import csv
+import io
 import shutil
+import sys
 from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import numpy as np
+import torch
 from PIL import Image
+from torchvision import transforms
 
 from fer.posterv2.face_detector import FaceDetector, NoFaceDetectedException
 from fer.posterv2.posterv2_recognizer import PosterV2Recognizer
 
+# face_detection_cache.py is shared with the image stages in vi_database_construction/b_construction_and_statistics
+sys.path.append(str(Path(__file__).resolve().parents[2] / 'vi_database_construction' / 'b_construction_and_statistics'))
+from face_detection_cache import FaceDetectionCache, get_detector_key, hash_bytes  # noqa: E402
+
+# A copy of POSTER_V2's test-time preprocessing for --batch-predictions (see BatchPosterV2Recognizer)
+INPUT_SIZE = (224, 224)
+NORMALIZATION_MEAN = [0.485, 0.456, 0.406]
+NORMALIZATION_STD = [0.229, 0.224, 0.225]
+PREPROCESS = transforms.Compose([
+    transforms.Resize(INPUT_SIZE),
+    transforms.ToTensor(),
+    transforms.Normalize(mean=NORMALIZATION_MEAN, std=NORMALIZATION_STD),
+])
+
+# POSTER_V2's face detector does not expose its detections, so the cache stores the outcome of a whole frame instead,
+# i.e., the predicted emotion probabilities or None if no face was detected.
+# Thus, the key identifies the recognizer's checkpoint (by the SHA-256 of its file) and the predictor as well.
+PREDICTION_SETTINGS = {'face_detector': 'posterv2:detect_face'}
+
 
 def parse_args():
     parser = argparse.ArgumentParser()
     parser.add_argument('path', type=str, help='Path to the directory to process')
+    parser.add_argument('--detection-cache', type=str, default=None,
+                        help='Path to a SQLite file in which the predictions per frame are cached')
+    parser.add_argument('--checkpoint', type=str, default=None,
+                        help='Path to the POSTER_V2 checkpoint loaded by the PosterV2Recognizer, '
+                             'required with --detection-cache to key the cached predictions')
+    parser.add_argument('--batch-size', type=int, default=32,
+                        help='Number of frames that are face-cropped and scored together')
+    parser.add_argument('--batch-predictions', action='store_true',
+                        help='Score the cropped faces of a batch with a single forward pass '
+                             'instead of calling predict_emotions per face')
     return parser.parse_args()
 
 
@@ -23,46 +56,127 @@ def custom_sort_key(key):
     return int(level.split(' ')[1]), int(num)
 
 
+class BatchPosterV2Recognizer(PosterV2Recognizer):
+    """
+    A PosterV2Recognizer that also scores a batch of cropped faces with a single forward pass of the model.
+    The preprocessing is a copy of POSTER_V2's test-time transform, as applied per face by predict_emotions.
+    test_select_best_guesses.py checks that both return the same probabilities.
+    """
+
+    def predict_emotions_batch(self, cropped_faces):
+        """Returns the emotion probabilities of each cropped face as an array of shape (faces, emotions)."""
+        batch = torch.stack([PREPROCESS(Image.fromarray(cropped_face)) for cropped_face in cropped_faces])
+        batch = batch.to(next(self.model.parameters()).device)
+        with torch.no_grad():
+            logits = self.model(batch)
+        return torch.softmax(logits, dim=1).cpu().numpy()
+
+
+def detect_face(image_data, face_detector):
+    """Returns the cropped face of the encoded image or None if no face was detected."""
+    image = Image.open(io.BytesIO(image_data))
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    image = np.array(image)
+    try:
+        cropped_face, _ = face_detector.detect_face(image)
+    except NoFaceDetectedException:
+        return None
+    return cropped_face
+
+
 def process_emote_dir(args):
-    emote_dir, face_detector, emotion_recognizer = args
+    """
+    Returns the frame of the emote directory with the highest probability for its emotion.
+    The candidate frames are decoded and face-cropped in batches of batch_size,
+    then the cropped faces of a batch are scored one by one or, with batch_predictions, with a single forward pass.
+    """
+    (emote_dir, face_detector, emotion_recognizer, batch_size, batch_predictions, detection_cache_path,
+     detector_key) = args
     target_emotion = emote_dir.name.split('-')[-1].lower()
+    emotion_index = emotion_recognizer.emotion_labels.index(target_emotion)
     best_score = 0
     best_image_data = (None, None)  # Tuple of (best_image_path, best_score)
 
+    # SQLite connections must not be shared between threads, so each task opens its own cache
+    detection_cache = None
+    if detection_cache_path is not None:
+        detection_cache = FaceDetectionCache(detection_cache_path, detector_key)
+
     sorted_files = sorted([file for file in emote_dir.glob('*.png') if not file.name.endswith('-1.png')],
                           key=lambda x: x.name)
+    candidate_files = sorted_files[15:]
+
+    for batch_start in range(0, len(candidate_files), batch_size):
+        batch_files = candidate_files[batch_start:batch_start + batch_size]
+
+        # Frames whose probabilities are cached are neither decoded nor face-cropped again
+        probabilities_per_file = {}
+        faces = []  # Tuples of (file, content_hash, cropped_face)
+        for file in batch_files:
+            image_data = file.read_bytes()
+            content_hash = None
+            if detection_cache is not None:
+                content_hash = hash_bytes(image_data)
+                cached = detection_cache.get(content_hash)
+                if cached is not None:
+                    probabilities_per_file[file] = cached['probabilities']
+                    continue
+
+            cropped_face = detect_face(image_data, face_detector)
+            if cropped_face is None:
+                probabilities_per_file[file] = None
+                if detection_cache is not None:
+                    detection_cache.put(content_hash, {'probabilities': None})
+            else:
+                faces.append((file, content_hash, cropped_face))
+
+        if faces:
+            cropped_faces = [face for _, _, face in faces]
+            if batch_predictions:
+                batch_probabilities = emotion_recognizer.predict_emotions_batch(cropped_faces)
+            else:
+                batch_probabilities = [emotion_recognizer.predict_emotions(face) for face in cropped_faces]
+            for (file, content_hash, _), probabilities in zip(faces, batch_probabilities):
+                probabilities = [float(probability) for probability in probabilities]
+                probabilities_per_file[file] = probabilities
+                if detection_cache is not None:
+                    detection_cache.put(content_hash, {'probabilities': probabilities})
+
+        for file in batch_files:
+            probabilities = probabilities_per_file[file]
+            if probabilities is None:
+                continue
 
-    for file in sorted_files[15:]:
-        try:
-            image = Image.open(file)
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
-            image = np.array(image)
-            cropped_face, _ = face_detector.detect_face(image)
-            probabilities = emotion_recognizer.predict_emotions(cropped_face)
-            emotion_index = emotion_recognizer.emotion_labels.index(target_emotion)
             score = probabilities[emotion_index]
-
             if score > best_score:
                 best_score = score
                 best_image_data = (file, score)
 
-        except NoFaceDetectedException:
-            continue
+    if detection_cache is not None:
+        detection_cache.close()
 
     return emote_dir.parent.name + ' - ' + emote_dir.name, best_image_data
 
 
-def process_directory(path: Path):
+def process_directory(path: Path, batch_size: int = 32, detection_cache_path: Path = None,
+                      checkpoint_path: Path = None, batch_predictions: bool = False):
     face_detector = FaceDetector()
-    emotion_recognizer = PosterV2Recognizer()
+    emotion_recognizer = BatchPosterV2Recognizer()
+    detector_key = None
+    if detection_cache_path is not None:
+        if checkpoint_path is None:
+            raise ValueError('Caching the predictions requires the path of the recognizer\'s checkpoint')
+        predictor = 'posterv2:predict_emotions_batch' if batch_predictions else 'posterv2:predict_emotions'
+        detector_key = get_detector_key(checkpoint_path, predictor=predictor, **PREDICTION_SETTINGS)
     tasks = []
 
     for level_dir in path.iterdir():
         if level_dir.is_dir() and level_dir.name in ['Level 1', 'Level 2', 'Level 3', 'Level 4']:
             for emote_dir in level_dir.iterdir():
                 if emote_dir.is_dir() and emote_dir.name.split('-')[0].isdigit():
-                    tasks.append((emote_dir, face_detector, emotion_recognizer))
+                    tasks.append((emote_dir, face_detector, emotion_recognizer, batch_size, batch_predictions,
+                                  detection_cache_path, detector_key))
 
     best_images = {}
     with ThreadPoolExecutor() as executor:
@@ -108,7 +222,14 @@ def main():
         print(f'The path {path} is not a valid directory.')
         return
 
-    best_images = process_directory(path)
+    detection_cache_path = Path(args.detection_cache) if args.detection_cache else None
+    if detection_cache_path is not None and args.checkpoint is None:
+        print('--detection-cache requires --checkpoint.')
+        return
+
+    checkpoint_path = Path(args.checkpoint) if args.checkpoint else None
+    best_images = process_directory(path, args.batch_size, detection_cache_path, checkpoint_path,
+                                    args.batch_predictions)
     create_labeling_directory(path, best_images)
     for emotion, (image_path, _) in best_images.items():
         print(f'Best image for {emotion}: {image_path}')
@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+
+# Run with python -m pytest in this directory,
+# with the facial-expression-recognition-microservice repository (see README.md) on the PYTHONPATH.
+# Skipped if torch or that repository is not available.
+pytest.importorskip('torch')
+pytest.importorskip('fer.posterv2.posterv2_recognizer')
+
+from select_best_guesses import BatchPosterV2Recognizer  # noqa: E402
+
+
+@pytest.fixture(scope='module')
+def emotion_recognizer():
+    return BatchPosterV2Recognizer()
+
+
+def test_batched_probabilities_equal_per_face_probabilities(emotion_recognizer):
+    # Cropped faces differ in size, so the resizing of the preprocessing is covered as well
+    rng = np.random.default_rng(0)
+    cropped_faces = [rng.integers(0, 256, size=(size, size, 3), dtype=np.uint8) for size in (96, 150, 224, 301)]
+
+    batch_probabilities = emotion_recognizer.predict_emotions_batch(cropped_faces)
+    per_face_probabilities = [emotion_recognizer.predict_emotions(cropped_face) for cropped_face in cropped_faces]
+
+    assert batch_probabilities.shape == (len(cropped_faces), len(emotion_recognizer.emotion_labels))
+    np.testing.assert_allclose(batch_probabilities, np.asarray(per_face_probabilities, dtype=np.float64), atol=1e-5)
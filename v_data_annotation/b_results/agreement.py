@@ -0,0 +1,105 @@
+import numpy as np
+
+# Vectorized inter-rater agreement metrics.
+#
+# All metrics are computed from per-subject tables (one subject = one labeled image):
+# the subject x category count matrix for Fleiss' kappa and a one-hot encoding of the label pairs for Cohen's kappa.
+# Every metric accepts optional subject weights of shape (..., subjects), i.e., how often each subject is counted.
+# A bootstrap resample is nothing but such a weight vector (drawing with replacement = multinomial counts),
+# so thousands of resamples are evaluated with a single matrix product instead of a Python loop.
+
+
+def encode_labels(data, label_cols, categories=None):
+    """
+    Encodes the label columns of a DataFrame as integer codes of shape (subjects, raters).
+    Returns the codes and the categories, which are the sorted union of all labels if not given.
+    """
+    values = data[label_cols].to_numpy().astype(str)
+    if categories is None:
+        categories = np.unique(values)
+    categories = np.asarray(categories, dtype=str)
+    codes = np.searchsorted(categories, values)
+    if np.any(codes >= len(categories)) or np.any(categories[np.minimum(codes, len(categories) - 1)] != values):
+        raise ValueError(f'Found labels that are not in the categories {list(categories)}')
+    return codes, categories
+
+
+def count_matrix(codes, n_categories):
+    """Returns the subject x category matrix of how many raters assigned each category to each subject."""
+    return np.eye(n_categories, dtype=np.int64)[codes].sum(axis=1)
+
+
+def subject_weights(n_subjects, weights=None):
+    return np.ones(n_subjects) if weights is None else np.asarray(weights, dtype=np.float64)
+
+
+def fleiss_kappa(counts, weights=None):
+    """
+    Fleiss' kappa of a subject x category count matrix with the same number of raters per subject.
+    Returns a scalar without weights and an array of shape weights.shape[:-1] otherwise.
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+    weights = subject_weights(counts.shape[0], weights)
+    n_raters = counts[0].sum()
+    if not np.all(counts.sum(axis=1) == n_raters):
+        raise ValueError('All subjects must be rated by the same number of raters')
+
+    n_subjects = weights.sum(axis=-1)
+    subject_agreement = (counts * (counts - 1)).sum(axis=1) / (n_raters * (n_raters - 1))
+    mean_agreement = weights @ subject_agreement / n_subjects
+    category_proportions = weights @ counts / (n_subjects[..., None] * n_raters)
+    chance_agreement = (category_proportions ** 2).sum(axis=-1)
+    return (mean_agreement - chance_agreement) / (1 - chance_agreement)
+
+
+def per_class_agreement(counts, weights=None):
+    """
+    Fleiss' category-specific kappa, i.e., the agreement on each category beyond chance.
+    Returns an array of shape (categories,) without weights and (*weights.shape[:-1], categories) otherwise.
+    The agreement on a category that no rater or every rater assigned to every subject is undefined (NaN),
+    e.g., for a bootstrap resample without any subject labeled with that category.
+    """
+    counts = np.asarray(counts, dtype=np.float64)
+    weights = subject_weights(counts.shape[0], weights)
+    n_raters = counts[0].sum()
+
+    n_subjects = weights.sum(axis=-1)[..., None]
+    category_proportions = weights @ counts / (n_subjects * n_raters)
+    disagreement = weights @ (counts * (n_raters - counts))
+    expected_disagreement = n_subjects * n_raters * (n_raters - 1) * category_proportions * (1 - category_proportions)
+    return 1 - np.divide(disagreement, expected_disagreement, out=np.full(disagreement.shape, np.nan),
+                         where=expected_disagreement > 0)
+
+
+def cohens_kappa(codes_1, codes_2, n_categories, weights=None):
+    """
+    Cohen's kappa between two raters, given their label codes of shape (subjects,).
+    Returns a scalar without weights and an array of shape weights.shape[:-1] otherwise.
+    """
+    weights = subject_weights(len(codes_1), weights)
+    pair_one_hot = np.eye(n_categories * n_categories)[np.asarray(codes_1) * n_categories + np.asarray(codes_2)]
+    joint = (weights @ pair_one_hot).reshape(*weights.shape[:-1], n_categories, n_categories)
+    joint /= joint.sum(axis=(-2, -1), keepdims=True)
+
+    observed_agreement = np.trace(joint, axis1=-2, axis2=-1)
+    chance_agreement = (joint.sum(axis=-1) * joint.sum(axis=-2)).sum(axis=-1)
+    return (observed_agreement - chance_agreement) / (1 - chance_agreement)
+
+
+def bootstrap_ci(statistic, n_subjects, n_resamples=10000, confidence=0.95, seed=0, chunk_size=1000):
+    """
+    Percentile bootstrap confidence interval of statistic, which maps subject weights of shape (resamples, subjects)
+    to values of shape (resamples, ...), e.g., lambda weights: fleiss_kappa(counts, weights).
+    The resamples are evaluated in chunks of chunk_size to bound memory.
+    Resamples for which the statistic is undefined (NaN) are skipped. Returns (lower, upper).
+    """
+    rng = np.random.default_rng(seed)
+    probabilities = np.full(n_subjects, 1 / n_subjects)
+    values = []
+    for chunk_start in range(0, n_resamples, chunk_size):
+        weights = rng.multinomial(n_subjects, probabilities, size=min(chunk_size, n_resamples - chunk_start))
+        values.append(statistic(weights))
+    values = np.concatenate(values)
+
+    alpha = (1 - confidence) / 2
+    return np.nanquantile(values, alpha, axis=0), np.nanquantile(values, 1 - alpha, axis=0)
@@ -5,8 +5,8 @@ import pandas as pd
 import seaborn as sns
 from matplotlib import pyplot as plt
 from sklearn.metrics import accuracy_score, confusion_matrix, classification_report
-from sklearn.metrics import cohen_kappa_score
-from statsmodels.stats.inter_rater import fleiss_kappa
+
+import agreement
 
 
 def calculate_accuracy(data, true_labels_col, predicted_labels_col):
@@ -39,9 +39,8 @@ def calculate_cohens_kappa(data, label_col1, label_col2):
     Returns:
     - kappa: float, Cohen's Kappa Score
     """
-    label_1 = data[label_col1]
-    label_2 = data[label_col2]
-    kappa = cohen_kappa_score(label_1, label_2)
+    codes, categories = agreement.encode_labels(data, [label_col1, label_col2])
+    kappa = agreement.cohens_kappa(codes[:, 0], codes[:, 1], len(categories))
     return kappa
 
 
@@ -56,16 +55,46 @@ def calculate_fleiss_kappa(data, label_cols):
     Returns:
     - kappa: float, Fleiss' Kappa score
     """
-    # Convert the label columns into a format suitable for Fleiss' Kappa computation
     # Count the frequency of each category in each row (image)
-    category_counts = data[label_cols].apply(lambda x: x.value_counts(), axis=1).fillna(0)
+    codes, categories = agreement.encode_labels(data, label_cols)
+    category_counts = agreement.count_matrix(codes, len(categories))
 
     # Compute Fleiss' Kappa
-    kappa = fleiss_kappa(category_counts)
+    kappa = agreement.fleiss_kappa(category_counts)
 
     return kappa
 
 
+def calculate_agreement_confidence_intervals(data, label_cols, n_resamples=10000, confidence=0.95, seed=0):
+    """
+    Calculate bootstrap confidence intervals of Fleiss' Kappa and of the per-class agreement.
+
+    Parameters:
+    - data: pandas DataFrame containing the labels
+    - label_cols: list of strings, names of the columns with labels from different raters
+    - n_resamples: int, number of bootstrap resamples of the images
+    - confidence: float, confidence level of the intervals
+    - seed: int, seed of the resampling
+
+    Returns:
+    - fleiss_ci: tuple of floats, lower and upper bound for Fleiss' Kappa
+    - per_class: pandas DataFrame with the per-class agreement and its lower and upper bound per category
+    """
+    codes, categories = agreement.encode_labels(data, label_cols)
+    category_counts = agreement.count_matrix(codes, len(categories))
+
+    # All resamples are evaluated at once, see agreement.py
+    fleiss_ci = agreement.bootstrap_ci(lambda weights: agreement.fleiss_kappa(category_counts, weights),
+                                       len(data), n_resamples, confidence, seed)
+    per_class_lower, per_class_upper = agreement.bootstrap_ci(
+        lambda weights: agreement.per_class_agreement(category_counts, weights),
+        len(data), n_resamples, confidence, seed)
+    per_class = pd.DataFrame({'kappa': agreement.per_class_agreement(category_counts),
+                              'lower': per_class_lower,
+                              'upper': per_class_upper}, index=categories)
+    return fleiss_ci, per_class
+
+
 def compute_confusion_matrix(df, label_cols):
     predicted_labels = df[label_cols].values.flatten()
     expected_labels = np.repeat(df['target_emotion'], 3)
@@ -110,6 +139,8 @@ if __name__ == '__main__':
     kappa_23 = calculate_cohens_kappa(df, 'label_2', 'label_3')
 
     fleiss_kappa_score = calculate_fleiss_kappa(df, ['label_1', 'label_2', 'label_3'])
+    fleiss_kappa_ci, per_class_agreement = calculate_agreement_confidence_intervals(
+        df, ['label_1', 'label_2', 'label_3'])
 
     compute_confusion_matrix(df, ['label_1', 'label_2', 'label_3'])
 
@@ -131,7 +162,12 @@ if __name__ == '__main__':
     print(f"Labeler 2 vs Labeler 3: {kappa_23:.4f}")
     print(f"Average: {mean([kappa_12, kappa_13, kappa_23]):.4f}")
 
-    print(f"\nFleiss' Kappa Score: {fleiss_kappa_score:.4f}")
+    print(f"\nFleiss' Kappa Score: {fleiss_kappa_score:.4f} "
+          f"(95% CI: {fleiss_kappa_ci[0]:.4f} - {fleiss_kappa_ci[1]:.4f})")
+
+    print("\nPer-Class Agreement (Fleiss' Kappa per Category, 95% CI):")
+    for emotion, row in per_class_agreement.iterrows():
+        print(f"{emotion}: {row['kappa']:.4f} ({row['lower']:.4f} - {row['upper']:.4f})")
 
 # OUTPUT
 #               precision    recall  f1-score   support
@@ -165,4 +201,13 @@ if __name__ == '__main__':
 # Labeler 2 vs Labeler 3: 0.7282
 # Average: 0.6782
 #
-# Fleiss' Kappa Score: 0.6776
+# Fleiss' Kappa Score: 0.6776 (95% CI: 0.6620 - 0.6931)
+#
+# Per-Class Agreement (Fleiss' Kappa per Category, 95% CI):
+# Anger: 0.5345 (0.4898 - 0.5751)
+# Disgust: 0.5302 (0.4891 - 0.5689)
+# Fear: 0.4391 (0.4020 - 0.4753)
+# Happiness: 0.9185 (0.9003 - 0.9352)
+# Neutral: 0.7901 (0.7660 - 0.8133)
+# Sadness: 0.6843 (0.6525 - 0.7140)
+# Surprise: 0.7006 (0.6687 - 0.7302)
@@ -0,0 +1,89 @@
+import csv
+import json
+import random
+from pathlib import Path, PurePosixPath
+
+from select_balanced_labeled_images import TEST_SET, TRAIN_SET, VAL_SET, balance_set, read_labels, split_by_participants
+
+# Instead of materializing a dataset per split, this script generates K leave-participants-out folds as manifests.
+# In fold i, the participants of group i form the test set, the participants of group i + 1 the validation set
+# and all other participants the training set.
+# As in select_balanced_labeled_images.py, the validation and test sets are balanced per emotion.
+#
+# <output-dir>
+# ├── folds.json        the seed and the participants of each set per fold
+# ├── fold-0.csv
+# ├── fold-1.csv
+#
+# Each row of fold-<i>.csv references one image of the original recordings by its path relative to
+# facial-recordings, which is also its path in the dataset catalog
+# (see vi_database_construction/b_construction_and_statistics/dataset_catalog.py).
+
+MANIFEST_COLUMNS = ['set', 'emotion', 'participant', 'camera_index', 'path']
+
+
+def assign_participant_groups(participants, k, seed):
+    """Shuffles the participants with the seed and distributes them round-robin across k groups."""
+    participants = sorted(participants, key=int)
+    random.Random(seed).shuffle(participants)
+    return [sorted(participants[i::k], key=int) for i in range(k)]
+
+
+def create_folds(labels, k=5, seed=0):
+    """Returns one {<set-name>: {<emotion>: {<participant>: [<source-path>, ...]}}} per fold and the split of each fold."""
+    participants = {participant for participant, _, _ in labels}
+    # The test, validation and training set of each fold need at least one group of participants each
+    if not 3 <= k <= len(participants):
+        raise ValueError(f'k must be between 3 and the number of participants ({len(participants)}), got {k}')
+    groups = assign_participant_groups(participants, k, seed)
+
+    folds = []
+    for i in range(k):
+        participant_split = {TEST_SET: groups[i], VAL_SET: groups[(i + 1) % k]}
+        source_paths = split_by_participants(labels, participant_split)
+        for set_name in [VAL_SET, TEST_SET]:
+            source_paths[set_name] = balance_set(source_paths[set_name], seed + i)
+        participant_split[TRAIN_SET] = sorted(set().union(*(participants for participants in
+                                                             source_paths[TRAIN_SET].values())), key=int)
+        folds.append((source_paths, participant_split))
+    return folds
+
+
+def write_manifest(source_paths, manifest_path):
+    with manifest_path.open(mode='w', newline='', encoding='utf-8') as manifest_file:
+        writer = csv.writer(manifest_file, delimiter=';')
+        writer.writerow(MANIFEST_COLUMNS)
+        for set_name in [TRAIN_SET, VAL_SET, TEST_SET]:
+            for emotion, participants in sorted(source_paths[set_name].items()):
+                for participant, paths in sorted(participants.items(), key=lambda item: int(item[0])):
+                    for source_path_central in paths:
+                        source_path_side_view = source_path_central.with_name(
+                            f'{source_path_central.stem}-1{source_path_central.suffix}')
+                        writer.writerow([set_name, emotion, participant, 0, source_path_central.as_posix()])
+                        writer.writerow([set_name, emotion, participant, 1, source_path_side_view.as_posix()])
+
+
+def main():
+    csv_file_path = Path(r'E:\mydata\emojihero\dataset\label.csv')
+    output_dir = Path(r'E:\mydata\emojihero\dataset-folds')
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    k = 5
+    seed = 0
+
+    # Paths relative to facial-recordings
+    labels = read_labels(csv_file_path, PurePosixPath())
+    folds = create_folds(labels, k, seed)
+
+    for i, (source_paths, _) in enumerate(folds):
+        manifest_path = output_dir / f'fold-{i}.csv'
+        write_manifest(source_paths, manifest_path)
+        print(f'Saved fold {i} to {manifest_path}')
+
+    with open(output_dir / 'folds.json', mode='w', encoding='utf-8') as folds_file:
+        json.dump({'k': k, 'seed': seed, 'folds': [participant_split for _, participant_split in folds]},
+                  folds_file, indent=2)
+
+
+if __name__ == '__main__':
+    main()
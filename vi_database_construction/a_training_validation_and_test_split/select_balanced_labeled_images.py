@@ -1,103 +1,153 @@
 import csv
 import random
-import shutil
 from collections import defaultdict
 from pathlib import Path
 
+from file_materialization import materialize_file
 
-def main():
-    csv_file_path = Path(r'E:\mydata\emojihero\dataset\label.csv')
-    base_dir = Path(r'E:\mydata\emojihero\participant-data\facial-recordings')
-    dest_base_dir = Path(r'E:\mydata\emojihero\dataset')
-    dest_base_dir.mkdir(parents=True, exist_ok=True)
+TRAIN_SET = 'training_set'
+VAL_SET = 'validation_set'
+TEST_SET = 'test_set'
 
-    TRAIN_SET = 'training_set'
-    VAL_SET = 'validation_set'
-    TEST_SET = 'test_set'
+# The participants of the validation and test set, all other participants belong to the training set
+PARTICIPANT_SPLIT = {
+    VAL_SET: ["2", "5", "6", "9", "14", "29", "32", "36"],
+    TEST_SET: ["1", "8", "10", "13", "15", "18", "23", "27"],
+}
 
-    train_base_dir = dest_base_dir / TRAIN_SET
-    train_base_dir.mkdir(parents=True, exist_ok=True)
-    val_base_dir = dest_base_dir / VAL_SET
-    val_base_dir.mkdir(parents=True, exist_ok=True)
-    test_base_dir = dest_base_dir / TEST_SET
-    test_base_dir.mkdir(parents=True, exist_ok=True)
-
-    source_paths_train = defaultdict(lambda: defaultdict(list))
-    source_paths_val = defaultdict(lambda: defaultdict(list))
-    source_paths_test = defaultdict(lambda: defaultdict(list))
-
-    emotion_count_per_participant = defaultdict(lambda: defaultdict(int))
 
+def read_labels(csv_file_path, base_dir):
+    """Returns a (participant, emotion, source_path) tuple for each row of the label csv."""
+    labels = []
     with csv_file_path.open(mode='r', newline='', encoding='utf-8') as csvfile:
         reader = csv.DictReader(csvfile, delimiter=';')
         for row in reader:
             participant = str(row['participant'])
             emotion = row['label']
-
-            emotion_count_per_participant[participant][emotion] += 2
-
             source_path = base_dir / participant / f"Level {row['level']}" / f"{row['emoji']}-{emotion}" / row['image']
-
-            if participant in ["2", "5", "6", "9", "14", "29", "32", "36"]:
-                source_paths_val[emotion][participant].append(source_path)
-
-            elif participant in ["1", "8", "10", "13", "15", "18", "23", "27"]:
-                source_paths_test[emotion][participant].append(source_path)
-
-            else:
-                source_paths_train[emotion][participant].append(source_path)
-
-    print('\n' + TRAIN_SET)
-    emotion_counts_train = {}
-    for emotion, participant_dict in sorted(source_paths_train.items()):
+            labels.append((participant, emotion, source_path))
+    return labels
+
+
+def split_by_participants(labels, participant_split, default_set=TRAIN_SET):
+    """
+    Assigns each label to the set of its participant.
+    participant_split maps set names to participant ids, participants not listed belong to default_set.
+    Returns {<set-name>: {<emotion>: {<participant>: [<source-path>, ...]}}}.
+    """
+    set_of_participant = {participant: set_name
+                          for set_name, participants in participant_split.items() for participant in participants}
+    source_paths = defaultdict(lambda: defaultdict(lambda: defaultdict(list)))
+    for participant, emotion, source_path in labels:
+        source_paths[set_of_participant.get(participant, default_set)][emotion][participant].append(source_path)
+    return source_paths
+
+
+def compute_quotas(counts, target, rng):
+    """
+    Distributes target samples across participants with the given counts by water-filling:
+    every participant keeps min(count, level) samples, where level is the highest level that does not exceed target,
+    and the remaining samples go to randomly chosen participants above that level.
+    This equals repeatedly removing a sample of the best represented participant, but in a single computation.
+    """
+    if target >= sum(counts.values()):
+        return dict(counts)
+
+    # Binary search for the highest level whose filling does not exceed target
+    low, high = 0, max(counts.values())
+    while low < high:
+        level = (low + high + 1) // 2
+        if sum(min(count, level) for count in counts.values()) <= target:
+            low = level
+        else:
+            high = level - 1
+    level = low
+
+    quotas = {participant: min(count, level) for participant, count in counts.items()}
+    participants_above_level = sorted(participant for participant, count in counts.items() if count > level)
+    for participant in rng.sample(participants_above_level, target - sum(quotas.values())):
+        quotas[participant] += 1
+    return quotas
+
+
+def balance_set_iteratively(source_paths):
+    """
+    The balancing of the published validation and test sets:
+    for every emotion, a random sample of the best represented participant is discarded
+    until the emotion is reduced to the number of samples of the least frequent emotion.
+    It is not seeded, so it cannot reproduce the exact published sets. Modifies source_paths in place.
+    """
+    min_samples = min(sum(len(paths) for paths in participant_dict.values())
+                      for participant_dict in source_paths.values())
+    for emotion, participant_dict in source_paths.items():
+        samples_to_remove = sum(len(paths) for paths in participant_dict.values()) - min_samples
+        for i in range(samples_to_remove):
+            best_represented_participant = max(participant_dict, key=lambda k: len(participant_dict[k]))
+            random_index = random.randint(0, len(participant_dict[best_represented_participant]) - 1)
+            del participant_dict[best_represented_participant][random_index]
+    return source_paths
+
+
+def balance_set(source_paths, seed):
+    """
+    Downsamples every emotion of a set to the number of samples of its least frequent emotion,
+    keeping the participants as evenly represented as possible (see compute_quotas).
+    Returns a new {<emotion>: {<participant>: [<source-path>, ...]}} and is reproducible for the same seed.
+    """
+    rng = random.Random(seed)
+    target = min(sum(len(paths) for paths in participant_dict.values()) for participant_dict in source_paths.values())
+
+    balanced_source_paths = {}
+    for emotion, participant_dict in sorted(source_paths.items()):
+        quotas = compute_quotas({participant: len(paths) for participant, paths in participant_dict.items()},
+                                target, rng)
+        balanced_source_paths[emotion] = {
+            participant: [paths[i] for i in sorted(rng.sample(range(len(paths)), quotas[participant]))]
+            for participant, paths in sorted(participant_dict.items())
+        }
+    return balanced_source_paths
+
+
+def print_label_distribution(set_name, source_paths):
+    print('\n' + set_name)
+    emotion_counts = {}
+    for emotion, participant_dict in sorted(source_paths.items()):
         num_samples = sum(len(paths) for paths in participant_dict.values())
         print(f'{emotion}: {num_samples}')
-        emotion_counts_train[emotion] = num_samples
+        emotion_counts[emotion] = num_samples
 
-    print(f'train label distribution: {emotion_counts_train}')
-    print(f'total number of labels: {sum(emotion_counts_train.values())}')
+    print(f'{set_name} label distribution: {emotion_counts}')
+    print(f'total number of labels: {sum(emotion_counts.values())}')
+    return emotion_counts
 
-    print('\n' + VAL_SET)
-    emotion_counts_val = {}
-    for emotion, participant_dict in sorted(source_paths_val.items()):
-        num_samples = sum(len(paths) for paths in participant_dict.values())
-        print(f'{emotion}: {num_samples}')
-        emotion_counts_val[emotion] = num_samples
 
-    min_samples_val = min(emotion_counts_val.values())
-    samples_to_remove_val = {emotion: count - min_samples_val for emotion, count in emotion_counts_val.items()}
-    print(f'validation label distribution: {emotion_counts_val}')
-    print(f'total number of labels: {sum(emotion_counts_val.values())}')
-    print(f'validation removal distribution {samples_to_remove_val}')
-    print(f'total number of labels to remove: {sum(samples_to_remove_val.values())}')
+def main():
+    csv_file_path = Path(r'E:\mydata\emojihero\dataset\label.csv')
+    base_dir = Path(r'E:\mydata\emojihero\participant-data\facial-recordings')
+    dest_base_dir = Path(r'E:\mydata\emojihero\dataset')
+    dest_base_dir.mkdir(parents=True, exist_ok=True)
 
-    for emotion, samples_to_remove in samples_to_remove_val.items():
-        participant_dict = source_paths_val[emotion]
-        for i in range(samples_to_remove):
-            best_represented_participant = max(participant_dict, key=lambda k: len(participant_dict[k]))
-            random_index = random.randint(0, len(participant_dict[best_represented_participant]) - 1)
-            del participant_dict[best_represented_participant][random_index]
+    # One of 'hardlink', 'reflink', 'symlink' or 'copy', see file_materialization.py
+    materialization_mode = 'hardlink'
 
-    print('\n' + TEST_SET)
-    emotion_counts_test = {}
-    for emotion, participant_dict in sorted(source_paths_test.items()):
-        num_samples = sum(len(paths) for paths in participant_dict.values())
-        print(f'{emotion}: {num_samples}')
-        emotion_counts_test[emotion] = num_samples
+    # 'iterative' is the balancing of the published validation and test sets (see balance_set_iteratively),
+    # 'quota' the optional seeded balancing (see balance_set), for which the same seed always selects the same images
+    balancing = 'iterative'
+    seed = 0
 
-    min_samples_test = min(emotion_counts_test.values())
-    samples_to_remove_test = {emotion: count - min_samples_test for emotion, count in emotion_counts_test.items()}
-    print(f'test label distribution {emotion_counts_test}')
-    print(f'total number of labels: {sum(emotion_counts_test.values())}')
-    print(f'test removal distribution {samples_to_remove_test}')
-    print(f'total number of labels to remove: {sum(samples_to_remove_test.values())}')
+    source_paths = split_by_participants(read_labels(csv_file_path, base_dir), PARTICIPANT_SPLIT)
 
-    for emotion, samples_to_remove in samples_to_remove_test.items():
-        participant_dict = source_paths_test[emotion]
-        for i in range(samples_to_remove):
-            best_represented_participant = max(participant_dict, key=lambda k: len(participant_dict[k]))
-            random_index = random.randint(0, len(participant_dict[best_represented_participant]) - 1)
-            del participant_dict[best_represented_participant][random_index]
+    print_label_distribution(TRAIN_SET, source_paths[TRAIN_SET])
+    for set_name in [VAL_SET, TEST_SET]:
+        emotion_counts = print_label_distribution(set_name, source_paths[set_name])
+        min_samples = min(emotion_counts.values())
+        samples_to_remove = {emotion: count - min_samples for emotion, count in emotion_counts.items()}
+        print(f'{set_name} removal distribution {samples_to_remove}')
+        print(f'total number of labels to remove: {sum(samples_to_remove.values())}')
+        if balancing == 'iterative':
+            source_paths[set_name] = balance_set_iteratively(source_paths[set_name])
+        else:
+            source_paths[set_name] = balance_set(source_paths[set_name], seed)
 
     def copy_images_to_set(source_paths, base_dir):
         for emotion, participants in source_paths.items():
@@ -110,17 +160,14 @@ def main():
                     dest_path_central = emotion_dir / f'{source_path_central.stem}-{participant}-0{source_path_central.suffix}'
                     dest_path_side_view = emotion_dir / f'{source_path_central.stem}-{participant}-1{source_path_central.suffix}'
 
-                    shutil.copy2(source_path_central, dest_path_central)
-                    shutil.copy2(source_path_side_view, dest_path_side_view)
-
-    print(f"\nCopying images for the {TRAIN_SET}")
-    copy_images_to_set(source_paths_train, train_base_dir)
-
-    print(f"\nCopying images for the {VAL_SET}")
-    copy_images_to_set(source_paths_val, val_base_dir)
+                    materialize_file(source_path_central, dest_path_central, materialization_mode)
+                    materialize_file(source_path_side_view, dest_path_side_view, materialization_mode)
 
-    print(f"\nCopying images for the {TEST_SET}")
-    copy_images_to_set(source_paths_test, test_base_dir)
+    for set_name in [TRAIN_SET, VAL_SET, TEST_SET]:
+        print(f"\nMaterializing images for the {set_name}")
+        set_base_dir = dest_base_dir / set_name
+        set_base_dir.mkdir(parents=True, exist_ok=True)
+        copy_images_to_set(source_paths[set_name], set_base_dir)
 
 
 if __name__ == '__main__':
@@ -1,5 +1,8 @@
+import bisect
 from pathlib import Path
-import shutil
+
+from file_materialization import materialize_file
+from recording_catalog import get_recording_path, load_recording_catalog
 
 
 def get_new_filename(timestamp, set_id, participant_id, level_id, emoji_id, emotion_id, camera_index):
@@ -28,29 +31,25 @@ def map_emotion_to_id(emotion_name):
     return emotion_mapping.get(emotion_name, -1)
 
 
-def is_original_side_view_image(image_path):
-    return image_path.stem.endswith('-1')
-
+def find_additional_images(recording, target_count=29):
+    # The timestamps of the recording's emoji directory and camera are already sorted in the catalog,
+    # so the recording's position is found by binary search instead of listing and sorting the directory again.
+    timestamps = recording.emoji_dir_timestamps
+    index = bisect.bisect_left(timestamps, recording.timestamp)
 
-def find_additional_images(original_image, emoji_dir, camera_index, target_count=29):
-    is_original_img_side_view = is_original_side_view_image(original_image)
-    all_images = sorted(
-        [img for img in emoji_dir.glob('*.png') if is_original_img_side_view == is_original_side_view_image(img)],
-        key=lambda x: int(x.stem.split('-')[0])
-    )
-    index = all_images.index(original_image)
+    # Collect images before the original image
+    before_timestamps = timestamps[max(0, index - target_count):index]
 
-    # Collect images before the original_image
-    before_images = all_images[max(0, index - target_count):index]
+    # If not enough images before, collect images after the original image
+    remaining_count = target_count - len(before_timestamps)
+    after_timestamps = timestamps[index + 1:index + 1 + remaining_count]
 
-    # If not enough images before, collect images after the original_image
-    remaining_count = target_count - len(before_images)
-    after_images = all_images[index + 1:index + 1 + remaining_count]
+    emoji_dir = recording.path.parent
+    return [get_recording_path(emoji_dir, timestamp, recording.camera_index)
+            for timestamp in before_timestamps + after_timestamps]
 
-    return before_images + after_images
 
-
-def process_image(image_path, original_base_path, dest_base_path, set_name):
+def process_image(image_path, recordings, dest_base_path, set_name, materialization_mode='copy'):
     set_id = set_name_to_id(set_name)
     parts = image_path.stem.split('-')
     if len(parts) < 3:
@@ -59,45 +58,42 @@ def process_image(image_path, original_base_path, dest_base_path, set_name):
     timestamp, participant_id, camera_index = parts[0], parts[1], parts[2]
     emotion_name = image_path.parent.name
     emotion_id = map_emotion_to_id(emotion_name)
-    original_camera_suffix = '' if camera_index == '0' else '-1'
-
-    # Search for the original image
-    participant_dir = original_base_path / participant_id
-    for level_dir in participant_dir.iterdir():
-        if level_dir.is_dir():
-            for emoji_dir in level_dir.iterdir():
-                if emoji_dir.is_dir() and emotion_name == emoji_dir.name.split('-')[1]:
-                    for original_image in emoji_dir.glob('*.png'):
-                        if original_image.stem == f'{timestamp}{original_camera_suffix}':
-                            level_id = level_dir.name.split()[-1]
-                            emoji_id = emoji_dir.name.split('-')[0]
-
-                            # Find additional images to form a sequence of 30, including the original image
-                            additional_images = find_additional_images(original_image, emoji_dir, camera_index)
-                            image_sequence = [original_image] + additional_images
-                            sequence_dir_name = get_new_filename(timestamp, set_id, participant_id, level_id, emoji_id,
-                                                                 emotion_id, camera_index).replace('.png', '')
-                            sequence_dest_dir = dest_base_path / set_name / emotion_name / sequence_dir_name
-                            sequence_dest_dir.mkdir(parents=True, exist_ok=True)
-
-                            for img in image_sequence:
-                                new_filename = get_new_filename(
-                                    img.stem.split('-')[0], set_id, participant_id, level_id, emoji_id, emotion_id,
-                                    camera_index
-                                )
-                                dest_path = sequence_dest_dir / new_filename
-                                shutil.copy2(img, dest_path)
-                                print(f"Copied: {img} -> {dest_path}")
-                            return
-
-
-def process_images(src_base_path, original_base_path, dest_base_path):
+
+    # Look up the original image in the recording catalog
+    recording = recordings.get((participant_id, int(timestamp), int(camera_index)))
+    if recording is None or recording.emotion_name != emotion_name:
+        print(f'Original image not found: {image_path}')
+        return
+    original_image = recording.path
+    level_id, emoji_id = recording.level_id, recording.emoji_id
+
+    # Find additional images to form a sequence of 30, including the original image
+    additional_images = find_additional_images(recording)
+    image_sequence = [original_image] + additional_images
+    sequence_dir_name = get_new_filename(timestamp, set_id, participant_id, level_id, emoji_id,
+                                         emotion_id, camera_index).replace('.png', '')
+    sequence_dest_dir = dest_base_path / set_name / emotion_name / sequence_dir_name
+    sequence_dest_dir.mkdir(parents=True, exist_ok=True)
+
+    for img in image_sequence:
+        new_filename = get_new_filename(
+            img.stem.split('-')[0], set_id, participant_id, level_id, emoji_id, emotion_id,
+            camera_index
+        )
+        dest_path = sequence_dest_dir / new_filename
+        used_mode = materialize_file(img, dest_path, materialization_mode)
+        print(f"Materialized ({used_mode}): {img} -> {dest_path}")
+
+
+def process_images(src_base_path, original_base_path, dest_base_path, materialization_mode='copy'):
+    recordings = load_recording_catalog(original_base_path)
+
     for set_dir in src_base_path.iterdir():
         if set_dir.is_dir():
             for emotion_dir in set_dir.iterdir():
                 if emotion_dir.is_dir():
                     for image in emotion_dir.glob('*.png'):
-                        process_image(image, original_base_path, dest_base_path, set_dir.name)
+                        process_image(image, recordings, dest_base_path, set_dir.name, materialization_mode)
 
 
 if __name__ == '__main__':
@@ -106,4 +102,7 @@ if __name__ == '__main__':
     original_base_path = Path(r'/media/thor/PortableSSD1/mydata/emojihero/participant-data/facial-recordings')
     dest_base_path = Path('/media/thor/PortableSSD1/mydata/emojihero/dataset/emoji-hero-vr-image-sequences-original-resolution')
 
-    process_images(dataset_base_path, original_base_path, dest_base_path)
+    # One of 'hardlink', 'reflink', 'symlink' or 'copy', see file_materialization.py
+    materialization_mode = 'hardlink'
+
+    process_images(dataset_base_path, original_base_path, dest_base_path, materialization_mode)
@@ -1,5 +1,7 @@
 from pathlib import Path
-import shutil
+
+from file_materialization import materialize_file
+from recording_catalog import load_recording_catalog
 
 
 def get_new_filename(timestamp, set_id, participant_id, level_id, emoji_id, emotion_id, camera_index):
@@ -28,7 +30,7 @@ def map_emotion_to_id(emotion_name):
     return emotion_mapping.get(emotion_name, -1)
 
 
-def process_image(image_path, original_base_path, dest_base_path, set_name):
+def process_image(image_path, recordings, dest_base_path, set_name, materialization_mode='copy'):
     set_id = set_name_to_id(set_name)
     parts = image_path.stem.split('-')
     if len(parts) < 3:
@@ -37,40 +39,35 @@ def process_image(image_path, original_base_path, dest_base_path, set_name):
     timestamp, participant_id, camera_index = parts[0], parts[1], parts[2]
     emotion_name = image_path.parent.name
     emotion_id = map_emotion_to_id(emotion_name)
-    original_camera_suffix = '' if camera_index == '0' else '-1'
-
-    # Search for the original image
-    participant_dir = original_base_path / participant_id
-    for level_dir in participant_dir.iterdir():
-        if level_dir.is_dir():
-            for emoji_dir in level_dir.iterdir():
-                if emoji_dir.is_dir() and emotion_name == emoji_dir.name.split('-')[1]:
-                    for original_image in emoji_dir.glob('*.png'):
-                        if original_image.stem == f'{timestamp}{original_camera_suffix}':
-                            level_id = level_dir.name.split()[-1]
-                            emoji_id = emoji_dir.name.split('-')[0]
-
-                            # Prepare the new filename and path
-                            new_filename = get_new_filename(
-                                timestamp, set_id, participant_id, level_id, emoji_id, emotion_id, camera_index
-                            )
-                            dest_dir = dest_base_path / set_name / emotion_name
-                            dest_dir.mkdir(parents=True, exist_ok=True)
-                            dest_path = dest_dir / new_filename
-
-                            # Copy the image to the new path
-                            shutil.copy2(original_image, dest_path)
-                            print(f"Copied: {original_image} -> {dest_path}")
-                            return
-
-
-def process_images(src_base_path, original_base_path, dest_base_path):
+
+    # Look up the original image in the recording catalog
+    recording = recordings.get((participant_id, int(timestamp), int(camera_index)))
+    if recording is None or recording.emotion_name != emotion_name:
+        print(f'Original image not found: {image_path}')
+        return
+
+    # Prepare the new filename and path
+    new_filename = get_new_filename(
+        timestamp, set_id, participant_id, recording.level_id, recording.emoji_id, emotion_id, camera_index
+    )
+    dest_dir = dest_base_path / set_name / emotion_name
+    dest_dir.mkdir(parents=True, exist_ok=True)
+    dest_path = dest_dir / new_filename
+
+    # Copy, hardlink, reflink or symlink the image to the new path
+    used_mode = materialize_file(recording.path, dest_path, materialization_mode)
+    print(f"Materialized ({used_mode}): {recording.path} -> {dest_path}")
+
+
+def process_images(src_base_path, original_base_path, dest_base_path, materialization_mode='copy'):
+    recordings = load_recording_catalog(original_base_path)
+
     for set_dir in src_base_path.iterdir():
         if set_dir.is_dir():
             for emotion_dir in set_dir.iterdir():
                 if emotion_dir.is_dir():
                     for image in emotion_dir.glob('*.png'):
-                        process_image(image, original_base_path, dest_base_path, set_dir.name)
+                        process_image(image, recordings, dest_base_path, set_dir.name, materialization_mode)
 
 
 if __name__ == '__main__':
@@ -79,4 +76,7 @@ if __name__ == '__main__':
     original_base_path = Path(r'/media/thor/PortableSSD1/mydata/emojihero/participant-data/facial-recordings')
     dest_base_path = Path('/media/thor/PortableSSD1/mydata/emojihero/dataset/emoji-hero-vr-db-images-original-resolution')
 
-    process_images(dataset_base_path, original_base_path, dest_base_path)
+    # One of 'hardlink', 'reflink', 'symlink' or 'copy', see file_materialization.py
+    materialization_mode = 'hardlink'
+
+    process_images(dataset_base_path, original_base_path, dest_base_path, materialization_mode)
@@ -0,0 +1,112 @@
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+
+import cv2
+
+from face_cropping import (MIN_DETECTION_CONFIDENCE, MODEL_PATH, crop_face, get_worker_detection_cache,
+                           get_worker_face_detector, init_worker, read_image)
+from face_detection_cache import get_detector_key
+from stage_state import StageState, write_bytes_atomically, write_image_atomically
+
+
+def process_image(img_path, input_path, output_path, output_size=(224, 224), quality=95,
+                  faces_output_path=None, resized_output_path=None):
+    """
+    Applies 1_crop_images2face.py, 2_resize_images.py and 3_to_jpg.py to a single image in memory.
+    The source png is decoded once and only the final jpg is written,
+    unless faces_output_path or resized_output_path ask for the intermediate pngs of stage 1 or 2, respectively.
+    Returns False if the jpg could not be encoded.
+    """
+    relative_path = img_path.relative_to(input_path)
+
+    np_image, content_hash = read_image(img_path)
+    cropped_image = crop_face(np_image, get_worker_face_detector(), get_worker_detection_cache(), content_hash)
+    if faces_output_path is not None:
+        write_image_atomically(faces_output_path / relative_path, cropped_image)
+
+    # 2_resize_images.py and 3_to_jpg.py load their input with IMREAD_COLOR, which drops the alpha channel
+    if cropped_image.ndim == 3 and cropped_image.shape[2] == 4:
+        cropped_image = cv2.cvtColor(cropped_image, cv2.COLOR_BGRA2BGR)
+
+    resized_image = cv2.resize(cropped_image, output_size, interpolation=cv2.INTER_LANCZOS4)
+    if resized_output_path is not None:
+        write_image_atomically(resized_output_path / relative_path, resized_image)
+
+    success, jpg_bytes = cv2.imencode('.jpg', resized_image, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+    if not success:
+        print(f'Could not encode {img_path} as JPG.')
+        return False
+    new_path = output_path / relative_path.with_suffix('.jpg')
+    write_bytes_atomically(new_path, jpg_bytes.tobytes())
+    print(f'Processed {img_path} and saved as {new_path}.')
+    return True
+
+
+def process_images(input_path, output_path, workers=1, output_size=(224, 224), quality=95,
+                   faces_output_path=None, resized_output_path=None, detection_cache_path=None, rebuild=False):
+    """Images whose output is up to date are skipped, unless rebuild is True (see stage_state.py)."""
+    params = {
+        'detector': get_detector_key(MODEL_PATH, min_detection_confidence=MIN_DETECTION_CONFIDENCE),
+        'output_size': list(output_size),
+        'quality': quality,
+        'faces_output_path': None if faces_output_path is None else str(faces_output_path),
+        'resized_output_path': None if resized_output_path is None else str(resized_output_path),
+    }
+    with StageState(output_path, params, rebuild) as state:
+        all_img_paths = list(input_path.rglob('*.png'))
+        # The requested intermediate versions are rebuilt as well if they are missing
+        extra_outputs = [(path, None) for path in (faces_output_path, resized_output_path) if path is not None]
+        img_paths = state.get_pending(all_img_paths, input_path, output_suffix='.jpg', extra_outputs=extra_outputs)
+        print(f'Skipping {len(all_img_paths) - len(img_paths)} up-to-date images')
+        process = partial(process_image, input_path=input_path, output_path=output_path, output_size=output_size,
+                          quality=quality, faces_output_path=faces_output_path, resized_output_path=resized_output_path)
+        start_time = time.perf_counter()
+        # Failed images are not recorded, so the next run retries them
+        failed_img_paths = []
+
+        if workers == 1:
+            init_worker(detection_cache_path)
+            for img_path in img_paths:
+                if process(img_path):
+                    state.record(img_path, input_path)
+                else:
+                    failed_img_paths.append(img_path)
+        else:
+            # MediaPipe is not fork-safe once it has been initialized in the parent process, so the workers are spawned
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                     initializer=init_worker, initargs=(detection_cache_path,)) as executor:
+                # Consume the results, so exceptions raised in the workers are not silently dropped
+                for img_path, success in zip(img_paths, executor.map(process, img_paths, chunksize=32)):
+                    if success:
+                        state.record(img_path, input_path)
+                    else:
+                        failed_img_paths.append(img_path)
+
+    elapsed_time = time.perf_counter() - start_time
+    print(f'Finished processing {len(img_paths)} images from {input_path} with {workers} worker(s) '
+          f'in {elapsed_time:.2f} seconds ({len(img_paths) / max(elapsed_time, 1e-9):.2f} images/sec). '
+          f'Saved to {output_path}')
+    if failed_img_paths:
+        print(f'Failed to process {len(failed_img_paths)} images: {[str(path) for path in failed_img_paths]}')
+
+
+if __name__ == '__main__':
+    input_path = Path(r'/media/thor/PortableSSD/emoji-hero-vr-db/emoji-hero-vr-db-images-original-resolution')
+    output_path = input_path.parent / 'emoji-hero-vr-db-images-224'
+    detection_cache_path = input_path.parent / 'face-detection-cache.sqlite'
+
+    # Set to True to additionally keep the intermediate versions of 1_crop_images2face.py and 2_resize_images.py
+    save_intermediate_versions = False
+    faces_output_path = None
+    resized_output_path = None
+    if save_intermediate_versions:
+        faces_output_path = input_path.parent / 'intermediate_versions' / 'emoji-hero-vr-db-images-faces-png'
+        resized_output_path = input_path.parent / 'intermediate_versions' / 'emoji-hero-vr-db-images-224-png'
+
+    process_images(input_path, output_path, workers=os.cpu_count(),
+                   faces_output_path=faces_output_path, resized_output_path=resized_output_path,
+                   detection_cache_path=detection_cache_path)
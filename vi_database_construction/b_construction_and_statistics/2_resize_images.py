@@ -2,20 +2,28 @@ from pathlib import Path
 
 import cv2
 
+from stage_state import StageState, write_image_atomically
+
 
 def resize_image_lanczos(image_path, new_path, output_size):
     img = cv2.imread(str(image_path))
     resized_img = cv2.resize(img, output_size, interpolation=cv2.INTER_LANCZOS4)
-    new_path.parent.mkdir(parents=True, exist_ok=True)
-    cv2.imwrite(str(new_path), resized_img)
-
-
-def process_images(input_path, output_path, output_size=(224, 224)):
-    for img_path in input_path.rglob('*.png'):
-        relative_path = img_path.relative_to(input_path)
-        new_path = output_path / relative_path
-        resize_image_lanczos(img_path, new_path, output_size)
-        print(f'Resized {img_path} to a resolution of {output_size} as {new_path}.')
+    write_image_atomically(new_path, resized_img)
+
+
+def process_images(input_path, output_path, output_size=(224, 224), rebuild=False):
+    """Images whose output is up to date are skipped, unless rebuild is True (see stage_state.py)."""
+    with StageState(output_path, {'output_size': list(output_size)}, rebuild) as state:
+        all_img_paths = list(input_path.rglob('*.png'))
+        img_paths = state.get_pending(all_img_paths, input_path)
+        print(f'Skipping {len(all_img_paths) - len(img_paths)} up-to-date images')
+
+        for img_path in img_paths:
+            relative_path = img_path.relative_to(input_path)
+            new_path = output_path / relative_path
+            resize_image_lanczos(img_path, new_path, output_size)
+            state.record(img_path, input_path)
+            print(f'Resized {img_path} to a resolution of {output_size} as {new_path}.')
 
     print(f'Finished resizing images from {input_path} to {output_path}')
 
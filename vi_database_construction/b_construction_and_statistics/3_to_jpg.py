@@ -2,19 +2,27 @@ from pathlib import Path
 
 import cv2
 
+from stage_state import StageState, write_image_atomically
+
 
 def save_as_jpg_with_high_quality(image_path, new_path, quality):
     img = cv2.imread(str(image_path), cv2.IMREAD_COLOR)  # Load PNG as RGB
-    new_path.parent.mkdir(parents=True, exist_ok=True)
-    cv2.imwrite(str(new_path).replace('.png', '.jpg'), img, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
-
-
-def process_images(input_path, output_path, quality=95):
-    for img_path in input_path.rglob('*.png'):
-        relative_path = img_path.relative_to(input_path)
-        new_path = output_path / relative_path.with_suffix('.jpg')
-        save_as_jpg_with_high_quality(img_path, new_path, quality)
-        print(f'Converted {img_path} to JPG as {new_path}.')
+    write_image_atomically(new_path.with_suffix('.jpg'), img, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+
+
+def process_images(input_path, output_path, quality=95, rebuild=False):
+    """Images whose output is up to date are skipped, unless rebuild is True (see stage_state.py)."""
+    with StageState(output_path, {'quality': quality}, rebuild) as state:
+        all_img_paths = list(input_path.rglob('*.png'))
+        img_paths = state.get_pending(all_img_paths, input_path, output_suffix='.jpg')
+        print(f'Skipping {len(all_img_paths) - len(img_paths)} up-to-date images')
+
+        for img_path in img_paths:
+            relative_path = img_path.relative_to(input_path)
+            new_path = output_path / relative_path.with_suffix('.jpg')
+            save_as_jpg_with_high_quality(img_path, new_path, quality)
+            state.record(img_path, input_path)
+            print(f'Converted {img_path} to JPG as {new_path}.')
 
     print(f'Finished processing images from {input_path}. Saved to {output_path}')
 
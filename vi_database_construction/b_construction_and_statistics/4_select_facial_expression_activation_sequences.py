@@ -1,68 +1,82 @@
-import csv
 import json
 from collections import defaultdict
 from pathlib import Path
 
-def find_and_save_expression_weights(dataset_path, facial_recordings_path):
+import numpy as np
+
+from fea_recordings import (align_to_valid_rows, count_time_differences, expression_weights_to_list,
+                            interpolate_valid_rows, load_fea_recording)
+
+# With alignment='nearest', each frame gets the weights of the nearest valid row within 30 ms.
+# With alignment='interpolate', the weights are linearly interpolated at the exact timestamp of each frame
+# between the valid rows before and after it (see interpolate_valid_rows in fea_recordings.py).
+# The same frames are kept, the time differences are those to the nearer of both rows.
+ALIGNMENTS = ['nearest', 'interpolate']
+
+
+def find_and_save_expression_weights(dataset_path, facial_recordings_path, alignment='nearest'):
+    if alignment not in ALIGNMENTS:
+        raise ValueError(f'Unknown alignment: {alignment}')
     output_path = dataset_path.parent / 'emoji-hero-vr-db-facial-expression-activation-sequences'
+    if alignment == 'interpolate':
+        output_path = output_path.with_name(f'{output_path.name}-interpolated')
     output_path.mkdir(parents=True, exist_ok=True)
     error_collection = defaultdict(list)
 
     time_differences = [5, 10, 15, 20, 30]
     td_counter = defaultdict(int)
 
-    i = 0
+    # png file name convention:
+    # <timestamp>-<set-id>-<participant-id>-<level-id>-<emoji-id>-<emotion-id>-<camera-index>.png
+    # Group the frames by participant, so each participant's cached recording is opened exactly once.
+    image_files_per_participant = defaultdict(list)
     for image_file in dataset_path.rglob('*-0.png'):
-        i += 1
-        if i % 500 == 0:
-            print(f'Processing file {i} : {image_file}')
-
-        # png file name convention:
-        # <timestamp>-<set-id>-<participant-id>-<level-id>-<emoji-id>-<emotion-id>-<camera-index>.png
-        file_name_parts = image_file.stem.split('-')
-        file_timestamp = int(file_name_parts[0])
-        participant_id = file_name_parts[2]
+        image_files_per_participant[image_file.stem.split('-')[2]].append(image_file)
 
+    i = 0
+    for participant_id, image_files in sorted(image_files_per_participant.items(), key=lambda item: int(item[0])):
         csv_file_path = facial_recordings_path / participant_id / 'faceexpressions.csv'
+        recording = load_fea_recording(csv_file_path)
 
-        with open(csv_file_path, mode='r', encoding='utf-8') as csv_file:
-            found = False
-            reader = csv.reader(csv_file, delimiter=';')
-            rows = list(reader)
+        # Align all frames of the participant at once, the loop below only writes the files
+        file_timestamps = np.array([int(image_file.stem.split('-')[0]) for image_file in image_files], dtype=np.int64)
+        if alignment == 'nearest':
+            indices, differences = align_to_valid_rows(recording, file_timestamps, max(time_differences))
+            weights = recording.weights[np.maximum(indices, 0)]
+        else:
+            weights, differences = interpolate_valid_rows(recording, file_timestamps, max(time_differences))
+        for max_diff, count in count_time_differences(differences, time_differences).items():
+            if count:
+                td_counter[max_diff] += count
+        # The smallest tolerance of each difference
+        tolerances = np.asarray(time_differences)[np.searchsorted(time_differences, np.maximum(differences, 0))]
 
-            for max_diff in time_differences:
-                for row in rows:
-                    if not row:
-                        continue
-                    row_ts = int(row[0])
-                    if abs(file_timestamp - row_ts) <= max_diff:
-                        try:
-                            expression_weights = json.loads(row[4])['ExpressionWeights']
+        for image_file, file_timestamp, expression_weights, difference, max_diff in zip(
+                image_files, file_timestamps.tolist(), weights, differences.tolist(), tolerances.tolist()):
+            i += 1
+            if i % 500 == 0:
+                print(f'Processing file {i} : {image_file}')
 
-                            # Remove camera index from file name
-                            json_file_name = '-'.join(file_name_parts[:-1]) + '.json'
+            if difference < 0:
+                error_collection[participant_id].append(file_timestamp)
+                print(f'No expression weights found for participant {participant_id} for timestamp {file_timestamp}.')
+                continue
 
-                            # Remove camera index from directory name
-                            output_json_path = output_path / (str(image_file.relative_to(dataset_path).parent)[:-2]) / json_file_name
-                            output_json_path.parent.mkdir(parents=True, exist_ok=True)
+            expression_weights = expression_weights_to_list(expression_weights)
 
-                            with open(output_json_path, 'w', encoding='utf-8') as json_file:
-                                json.dump(expression_weights, json_file)
+            # Remove camera index from file name
+            file_name_parts = image_file.stem.split('-')
+            json_file_name = '-'.join(file_name_parts[:-1]) + '.json'
 
-                            found = True
-                            td_counter[max_diff] += 1
+            # Remove camera index from directory name
+            output_json_path = output_path / (str(image_file.relative_to(dataset_path).parent)[:-2]) / json_file_name
+            output_json_path.parent.mkdir(parents=True, exist_ok=True)
 
-                            if max_diff >= 15:
-                                print(f'Found expression weights for participant {participant_id} for timestamp {file_timestamp} with difference >= {max_diff} milliseconds.')
-                            break
-                        except json.JSONDecodeError:
-                            continue
-                if found:
-                    break
+            with open(output_json_path, 'w', encoding='utf-8') as json_file:
+                json.dump(expression_weights, json_file)
 
-            if not found:
-                error_collection[participant_id].append(file_timestamp)
-                print(f'No expression weights found for participant {participant_id} for timestamp {file_timestamp}.')
+            if max_diff >= 15:
+                print(f'Found expression weights for participant {participant_id} for timestamp {file_timestamp} with difference >= {max_diff} milliseconds.')
 
     print("\nTime Difference Categories:")
     for max_diff in sorted(td_counter.keys()):
@@ -74,7 +88,9 @@ def find_and_save_expression_weights(dataset_path, facial_recordings_path):
 if __name__ == '__main__':
     dataset_path = Path(r'/media/thor/PortableSSD/mydata/emojihero/dataset/emoji-hero-vr-image-sequences-original-resolution')
     facial_recordings_path = Path(r'/media/thor/PortableSSD/mydata/emojihero/participant-data/facial-recordings')
-    find_and_save_expression_weights(dataset_path, facial_recordings_path)
+    # 'interpolate' writes to emoji-hero-vr-db-facial-expression-activation-sequences-interpolated instead
+    alignment = 'nearest'
+    find_and_save_expression_weights(dataset_path, facial_recordings_path, alignment)
 
 # Manually removed /media/thor/PortableSSD/mydata/emojihero/dataset/emoji-hero-vr-db-facial-expression-activation-sequences/training_set/Disgust/1701188073794-0-31-2-5-1 after execution
 # because 1701188073794-0-31-2-5-1 is not included in the static version
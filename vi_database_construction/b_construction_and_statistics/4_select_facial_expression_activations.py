@@ -1,54 +1,100 @@
-import csv
 import json
+from collections import defaultdict
 from pathlib import Path
 
+import numpy as np
 
-def find_and_save_expression_weights(dataset_path, facial_recordings_path):
+from fea_recordings import align_to_valid_rows, expression_weights_to_list, load_fea_recording
+
+# For the static version, abs(file_timestamp - row_ts) <= MAX_DIFF holds for all included samples.
+# Of the rows within this window, the nearest one with a valid payload is used.
+MAX_DIFF = 5
+# The headset records a row every ~16 ms (~62.8 Hz).
+# Only with fallback_to_neighbour_rows=True, if all rows within MAX_DIFF milliseconds hold an invalid payload,
+# the nearest valid row within MAX_FALLBACK_DIFF milliseconds, i.e., usually a direct neighbour, is used instead.
+# As this changes the definition of the static version, the results are written to a separate directory.
+MAX_FALLBACK_DIFF = 20
+
+
+def find_and_save_expression_weights(dataset_path, facial_recordings_path, fallback_to_neighbour_rows=False):
     output_path = dataset_path.parent / 'emoji-hero-vr-db-facial-expression-activations'
+    if fallback_to_neighbour_rows:
+        output_path = output_path.with_name(f'{output_path.name}-with-neighbour-rows')
     output_path.mkdir(parents=True, exist_ok=True)
+    recordings = {}
+    fallbacks = defaultdict(list)
+    missing = defaultdict(list)
+
+    # jpg file name convention:
+    # <timestamp>-<set-id>-<participant-id>-<level-id>-<emoji-id>-<emotion-id>-<camera-index>.jpg
+    image_files = list(dataset_path.rglob('*-0.jpg'))
+    file_timestamps = np.array([int(image_file.stem.split('-')[0]) for image_file in image_files], dtype=np.int64)
+    participant_ids = np.array([image_file.stem.split('-')[2] for image_file in image_files])
 
-    for image_file in dataset_path.rglob('*-0.jpg'):
+    # Align the samples of each participant at once, the loop below only writes the files
+    indices = np.full(len(image_files), -1, dtype=np.int64)
+    is_invalid = np.zeros(len(image_files), dtype=bool)
+    is_fallback = np.zeros(len(image_files), dtype=bool)
+    for participant_id in dict.fromkeys(participant_ids.tolist()):
+        recording = recordings[participant_id] = load_fea_recording(
+            facial_recordings_path / participant_id / 'faceexpressions.csv')
+        samples = np.flatnonzero(participant_ids == participant_id)
+        timestamps = file_timestamps[samples]
+        indices[samples] = align_to_valid_rows(recording, timestamps, MAX_DIFF)[0]
 
-        # jpg file name convention:
-        # <timestamp>-<set-id>-<participant-id>-<level-id>-<emoji-id>-<emotion-id>-<camera-index>.jpg
-        file_name_parts = image_file.stem.split('-')
-        file_timestamp = int(file_name_parts[0])
-        participant_id = file_name_parts[2]
+        # Rows within MAX_DIFF milliseconds exist, but all of them hold an invalid payload
+        start = np.searchsorted(recording.timestamps, timestamps - MAX_DIFF, side='left')
+        end = np.searchsorted(recording.timestamps, timestamps + MAX_DIFF, side='right')
+        samples = samples[(indices[samples] < 0) & (end > start)]
+        is_invalid[samples] = True
+        if not fallback_to_neighbour_rows:
+            continue
+        fallback_indices = align_to_valid_rows(recording, file_timestamps[samples], MAX_FALLBACK_DIFF)[0]
+        indices[samples] = fallback_indices
+        is_fallback[samples] = fallback_indices >= 0
 
+    for image_file, file_timestamp, participant_id, index, invalid, fallback in zip(
+            image_files, file_timestamps.tolist(), participant_ids.tolist(), indices.tolist(), is_invalid.tolist(),
+            is_fallback.tolist()):
+        recording = recordings[participant_id]
         csv_file_path = facial_recordings_path / participant_id / 'faceexpressions.csv'
+        if fallback:
+            fallbacks[participant_id].append(file_timestamp)
+            print(f'Invalid JSON in {csv_file_path} for timestamp {file_timestamp}. '
+                  f'Using the row {abs(int(recording.timestamps[index]) - file_timestamp)} ms apart.')
+        elif invalid:
+            print(f'Invalid JSON in {csv_file_path} for timestamp {file_timestamp}. Skipping...')
 
-        with open(csv_file_path, mode='r', encoding='utf-8') as csv_file:
-            found = False
-            reader = csv.reader(csv_file, delimiter=';')
-            for row in reader:
-                if row:
-                    row_ts = int(row[0])
-                    if abs(file_timestamp - row_ts) <= 5:
-                        try:
-                            expression_weights = json.loads(row[4])['ExpressionWeights']
+        if index < 0:
+            missing[participant_id].append(file_timestamp)
+            print(f'No expression weights found for participant {participant_id} for timestamp {file_timestamp}.')
+            continue
 
-                            # Remove camera index from file name
-                            json_file_name = '-'.join(file_name_parts[:-1]) + '.json'
+        expression_weights = expression_weights_to_list(recording.weights[index])
 
-                            output_json_path = output_path / image_file.relative_to(dataset_path).parent / json_file_name
-                            output_json_path.parent.mkdir(parents=True, exist_ok=True)
-                            with open(output_json_path, 'w', encoding='utf-8') as json_file:
-                                json.dump(expression_weights, json_file)
+        # Remove camera index from file name
+        json_file_name = '-'.join(image_file.stem.split('-')[:-1]) + '.json'
 
-                            found = True
-                            break
-                        except json.JSONDecodeError:
-                            print(f'Invalid JSON in {csv_file_path} for timestamp {file_timestamp}. Skipping...')
+        output_json_path = output_path / image_file.relative_to(dataset_path).parent / json_file_name
+        output_json_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(output_json_path, 'w', encoding='utf-8') as json_file:
+            json.dump(expression_weights, json_file)
 
-            if not found:
-                print(f'No expression weights found for participant {participant_id} for timestamp {file_timestamp}.')
+    for participant_id, recording in sorted(recordings.items(), key=lambda item: int(item[0])):
+        if recording.repaired_rows or recording.invalid_rows or fallbacks[participant_id] or missing[participant_id]:
+            print(f'Participant {participant_id}: {recording.repaired_rows} repaired and {recording.invalid_rows} '
+                  f'dropped rows, {len(fallbacks[participant_id])} samples with a neighbouring row, '
+                  f'{len(missing[participant_id])} samples without expression weights')
 
 
 if __name__ == '__main__':
     dataset_path = Path(r'/media/thor/PortableSSD/mydata/emojihero/dataset/emoji-hero-vr-db-images-224')
     facial_recordings_path = Path(r'/media/thor/PortableSSD/mydata/emojihero/participant-data/facial-recordings')
-    find_and_save_expression_weights(dataset_path, facial_recordings_path)
+    # True writes to emoji-hero-vr-db-facial-expression-activations-with-neighbour-rows instead
+    fallback_to_neighbour_rows = False
+    find_and_save_expression_weights(dataset_path, facial_recordings_path, fallback_to_neighbour_rows)
 
+# Output before malformed rows were repaired:
 # Invalid JSON in /media/thor/PortableSSD/mydata/emojihero/participant-data/facial-recordings/7/faceexpressions.csv for timestamp 1700566360473. Skipping...
 # No expression weights found for participant 7 for timestamp 1700566360473.
 # Invalid JSON in /media/thor/PortableSSD/mydata/emojihero/participant-data/facial-recordings/7/faceexpressions.csv for timestamp 1700566368554. Skipping...
@@ -1,7 +1,12 @@
 import json
+import os
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 
 # Below are the names of the 63 Face Expressions we captured using the Face Tracking API.
 # We used version 59.0 of the Meta XR Core SDK, which included the Face Tracking API.
@@ -36,6 +41,9 @@ fea_names = [
     'UpperLidRaiserL', 'UpperLidRaiserR', 'UpperLipRaiserL', 'UpperLipRaiserR'
 ]
 
+# Each sequence of EmoHeVRDB-DFEA consists of exactly 30 FEA recordings
+SEQUENCE_LENGTH = 30
+
 
 def load_data(subset_dir: Path):
     feas = []
@@ -83,13 +91,141 @@ def save_to_csv(feas, labels, timestamps, sequence_ids, output_file):
     print(f'Data saved to {output_file}')
 
 
+def to_arrow_table(feas, labels, timestamps, sequence_ids, subset_name):
+    """
+    Returns the data of a subset as typed Arrow table sorted by sequence_id and timestamp like the csv file:
+    sequence_id and subset are dictionary-encoded, timestamp is int64, the FEAs are float32 and Label is int8.
+    """
+    if len(feas[0]) != 63 or len(fea_names) != 63:
+        raise ValueError('Number of FEAs is not as expected (63))')
+
+    df = pd.DataFrame(np.asarray(feas, dtype=np.float32), columns=fea_names)
+    df.insert(0, 'sequence_id', sequence_ids)
+    df.insert(1, 'timestamp', np.asarray(timestamps, dtype=np.int64))
+    df['Label'] = np.asarray(labels, dtype=np.int8)
+
+    df.sort_values(by=['sequence_id', 'timestamp'], inplace=True)
+
+    df.insert(0, 'subset', subset_name)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    # Arrow's dictionary encoding always uses int32 indices, so the schemas of all subsets match
+    for column_name in ['subset', 'sequence_id']:
+        column_index = table.schema.get_field_index(column_name)
+        table = table.set_column(column_index, column_name, table[column_name].dictionary_encode())
+    return table
+
+
+def save_to_parquet(tables, output_file):
+    """Writes the tables of all subsets into one Parquet file, one row group per subset."""
+    writer = None
+    for table in tables:
+        if writer is None:
+            writer = pq.ParquetWriter(output_file, table.schema)
+        writer.write_table(table, row_group_size=max(table.num_rows, 1))
+    if writer is not None:
+        writer.close()
+    print(f'Data saved to {output_file}')
+
+
+def read_sequence(sequence_dir: Path):
+    """
+    Reads all JSON files of a sequence directory, sorted by timestamp.
+    Returns the FEAs as float32 array of shape (30, 63), the timestamps, the label and the participant id.
+    """
+    file_paths = sorted(file_path for file_path in sequence_dir.iterdir() if file_path.is_file())
+    if len(file_paths) != SEQUENCE_LENGTH:
+        raise ValueError(f'Expected {SEQUENCE_LENGTH} files in {sequence_dir}, found {len(file_paths)}')
+
+    feas = np.empty((SEQUENCE_LENGTH, len(fea_names)), dtype=np.float32)
+    timestamps = np.empty(SEQUENCE_LENGTH, dtype=np.int64)
+    labels = set()
+    participant_ids = set()
+    for i, file_path in enumerate(file_paths):
+        with file_path.open('r') as f:
+            feas[i] = json.load(f)
+
+        parts = file_path.stem.split('-')
+        if len(parts) != 6:
+            raise ValueError(f'Unexpected filename format: {file_path.stem}')
+        timestamp, set_id, participant_id, level_id, emoji_id, emotion_id = parts
+        timestamps[i] = int(timestamp)
+        labels.add(int(emotion_id))
+        participant_ids.add(int(participant_id))
+
+    if len(labels) != 1 or len(participant_ids) != 1:
+        raise ValueError(f'Sequence {sequence_dir} mixes labels {labels} or participants {participant_ids}')
+    return feas, timestamps, labels.pop(), participant_ids.pop()
+
+
+def save_packed(subset_dir: Path, output_dir: Path, workers: int = None):
+    """
+    Saves all sequences of a subset as aligned .npy files in output_dir:
+    feas.npy (float32, shape (sequences, 30, 63)), timestamps.npy (int64, shape (sequences, 30)),
+    labels.npy (int8), participant_ids.npy (int16) and sequence_ids.npy, ordered by sequence id.
+    The JSON files are read by a process pool and the FEAs are written directly into the memory-mapped feas.npy.
+    """
+    sequence_dirs = sorted((sequence_dir for category_dir in subset_dir.iterdir() if category_dir.is_dir()
+                            for sequence_dir in category_dir.iterdir() if sequence_dir.is_dir()),
+                           key=lambda sequence_dir: sequence_dir.name)
+    number_of_sequences = len(sequence_dirs)
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    feas = np.lib.format.open_memmap(output_dir / 'feas.npy', mode='w+', dtype=np.float32,
+                                     shape=(number_of_sequences, SEQUENCE_LENGTH, len(fea_names)))
+    timestamps = np.empty((number_of_sequences, SEQUENCE_LENGTH), dtype=np.int64)
+    labels = np.empty(number_of_sequences, dtype=np.int8)
+    participant_ids = np.empty(number_of_sequences, dtype=np.int16)
+
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        sequences = executor.map(read_sequence, sequence_dirs, chunksize=16)
+        for i, (sequence_feas, sequence_timestamps, label, participant_id) in enumerate(sequences):
+            feas[i] = sequence_feas
+            timestamps[i] = sequence_timestamps
+            labels[i] = label
+            participant_ids[i] = participant_id
+
+    feas.flush()
+    del feas
+    np.save(output_dir / 'timestamps.npy', timestamps)
+    np.save(output_dir / 'labels.npy', labels)
+    np.save(output_dir / 'participant_ids.npy', participant_ids)
+    np.save(output_dir / 'sequence_ids.npy', np.array([sequence_dir.name for sequence_dir in sequence_dirs]))
+    with open(output_dir / 'fea_names.json', 'w', encoding='utf-8') as f:
+        json.dump(fea_names, f)
+    print(f'{number_of_sequences} sequences saved to {output_dir}')
+
+
+def load_packed(packed_dir: Path) -> dict:
+    """Loads the arrays saved by save_packed. feas.npy is memory-mapped, i.e., it is not read into memory."""
+    return {
+        'feas': np.load(packed_dir / 'feas.npy', mmap_mode='r'),
+        'timestamps': np.load(packed_dir / 'timestamps.npy'),
+        'labels': np.load(packed_dir / 'labels.npy'),
+        'participant_ids': np.load(packed_dir / 'participant_ids.npy'),
+        'sequence_ids': np.load(packed_dir / 'sequence_ids.npy'),
+    }
+
+
 if __name__ == '__main__':
     base_directory = Path(r'/media/thor/PortableSSD/emoji-hero-vr-db/dataset/emoji-hero-vr-db/emoji-hero-vr-db-dfea')
-    output_dir = base_directory.parent / (base_directory.name + '-as-csv')
+
+    # 'csv' for one long-format csv file per subset,
+    # 'npy' for one directory of packed, memory-mappable arrays per subset (see save_packed),
+    # 'parquet' for a single Parquet file with one row group per subset (see to_arrow_table)
+    export_format = 'csv'
+
+    output_dir = base_directory.parent / (base_directory.name + f'-as-{export_format}')
     output_dir.mkdir(exist_ok=True)
+    subset_dirs = [subset_dir for subset_dir in base_directory.iterdir() if subset_dir.is_dir()]
+
+    if export_format == 'parquet':
+        save_to_parquet((to_arrow_table(*load_data(subset_dir), subset_dir.name) for subset_dir in subset_dirs),
+                        output_dir / f'{base_directory.name}.parquet')
 
-    for subset_dir in base_directory.iterdir():
-        if subset_dir.is_dir():
+    for subset_dir in subset_dirs:
+        if export_format == 'npy':
+            save_packed(subset_dir, output_dir / subset_dir.name)
+        elif export_format == 'csv':
             feas, labels, timestamps, sequence_ids = load_data(subset_dir)
             output_file = output_dir / f'{subset_dir.name}.csv'
             save_to_csv(feas, labels, timestamps, sequence_ids, output_file)
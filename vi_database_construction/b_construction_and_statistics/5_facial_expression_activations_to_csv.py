@@ -1,7 +1,10 @@
 import json
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 
 # Below are the names of the 63 Face Expressions we captured using the Face Tracking API.
 # We used version 59.0 of the Meta XR Core SDK, which included the Face Tracking API.
@@ -79,13 +82,54 @@ def save_to_csv(feas, labels, timestamps, file_ids, output_file):
     print(f'Data saved to {output_file}')
 
 
+def to_arrow_table(feas, labels, timestamps, file_ids, subset_name):
+    """
+    Returns the data of a subset as typed Arrow table:
+    file_id and subset are dictionary-encoded, timestamp is int64, the FEAs are float32 and Label is int8.
+    """
+    if len(feas[0]) != 63 or len(fea_names) != 63:
+        raise ValueError('Number of FEAs is not as expected (63))')
+
+    df = pd.DataFrame(np.asarray(feas, dtype=np.float32), columns=fea_names)
+    df.insert(0, 'file_id', file_ids)
+    df.insert(1, 'timestamp', np.asarray(timestamps, dtype=np.int64))
+    df['Label'] = np.asarray(labels, dtype=np.int8)
+    df.insert(0, 'subset', subset_name)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    # Arrow's dictionary encoding always uses int32 indices, so the schemas of all subsets match
+    for column_name in ['subset', 'file_id']:
+        column_index = table.schema.get_field_index(column_name)
+        table = table.set_column(column_index, column_name, table[column_name].dictionary_encode())
+    return table
+
+
+def save_to_parquet(tables, output_file):
+    """Writes the tables of all subsets into one Parquet file, one row group per subset."""
+    writer = None
+    for table in tables:
+        if writer is None:
+            writer = pq.ParquetWriter(output_file, table.schema)
+        writer.write_table(table, row_group_size=max(table.num_rows, 1))
+    if writer is not None:
+        writer.close()
+    print(f'Data saved to {output_file}')
+
+
 if __name__ == '__main__':
     base_directory = Path(r'/media/thor/PortableSSD/emoji-hero-vr-db/dataset/emoji-hero-vr-db/emoji-hero-vr-db-sfea')
-    output_dir = base_directory.parent / (base_directory.name + '-as-csv')
+
+    # 'csv' for one csv file per subset, 'parquet' for a single Parquet file with one row group per subset
+    export_format = 'csv'
+
+    output_dir = base_directory.parent / (base_directory.name + f'-as-{export_format}')
     output_dir.mkdir(exist_ok=True)
+    subset_dirs = [subset_dir for subset_dir in base_directory.iterdir() if subset_dir.is_dir()]
 
-    for subset_dir in base_directory.iterdir():
-        if subset_dir.is_dir():
+    if export_format == 'parquet':
+        save_to_parquet((to_arrow_table(*load_data(subset_dir), subset_dir.name) for subset_dir in subset_dirs),
+                        output_dir / f'{base_directory.name}.parquet')
+    else:
+        for subset_dir in subset_dirs:
             feas, labels, timestamps, file_ids = load_data(subset_dir)
             output_file = output_dir / f'{subset_dir.name}.csv'
             save_to_csv(feas, labels, timestamps, file_ids, output_file)
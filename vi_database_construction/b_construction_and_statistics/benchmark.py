@@ -0,0 +1,181 @@
+import argparse
+import importlib
+import json
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+from synthetic_recordings import generate_dataset, generate_facial_recordings
+
+# Runs the construction stages on synthetic recordings (see synthetic_recordings.py) and records
+# their wall time, CPU time, throughput and peak memory (RSS) to a JSON file for regression tracking.
+# Each stage runs in its own Python process, so the peak RSS of one stage is not inflated by the previous ones.
+# Worker processes spawned by a stage are reported separately as children_max_rss_mb.
+#
+# <work-dir>
+# ├── facial-recordings                  synthetic_recordings.py
+# ├── dataset                            synthetic_recordings.py
+# ├── images-original-resolution         organize     (0_organize_images.py)
+# ├── images-faces-png                   crop         (1_crop_images2face.py)
+# ├── images-224-png                     resize       (2_resize_images.py)
+# ├── images-224                         jpg          (3_to_jpg.py)
+# │                                      fea_cache    (fea_recordings.py, writes next to faceexpressions.csv)
+# ├── emoji-hero-vr-db-facial-expression-activations
+# │                                      fea_selection (4_select_facial_expression_activations.py)
+# ├── facial-expression-activations-as-csv
+# │                                      csv_export   (5_facial_expression_activations_to_csv.py)
+# ├── logs/<stage>.log                   the output of each stage
+#
+# All stages rebuild their outputs, so repeated runs measure the same work.
+
+STAGES = ['organize', 'crop', 'resize', 'jpg', 'fea_cache', 'fea_selection', 'csv_export']
+
+
+def count_files(path, pattern):
+    return sum(1 for file_path in path.rglob(pattern) if file_path.is_file())
+
+
+def run_stage(stage, work_dir, workers):
+    """Runs a single stage in this process and returns the number of processed items."""
+    facial_recordings_path = work_dir / 'facial-recordings'
+    if stage == 'organize':
+        output_path = work_dir / 'images-original-resolution'
+        shutil.rmtree(output_path, ignore_errors=True)
+        importlib.import_module('0_organize_images').process_images(work_dir / 'dataset', facial_recordings_path,
+                                                                    output_path)
+        return count_files(output_path, '*.png')
+    if stage == 'crop':
+        input_path = work_dir / 'images-original-resolution'
+        importlib.import_module('1_crop_images2face').process_images(input_path, work_dir / 'images-faces-png',
+                                                                     workers=workers, rebuild=True)
+        return count_files(input_path, '*.png')
+    if stage == 'resize':
+        input_path = work_dir / 'images-faces-png'
+        importlib.import_module('2_resize_images').process_images(input_path, work_dir / 'images-224-png',
+                                                                  rebuild=True)
+        return count_files(input_path, '*.png')
+    if stage == 'jpg':
+        input_path = work_dir / 'images-224-png'
+        importlib.import_module('3_to_jpg').process_images(input_path, work_dir / 'images-224', rebuild=True)
+        return count_files(input_path, '*.png')
+    if stage == 'fea_cache':
+        module = importlib.import_module('fea_recordings')
+        module.build_all_fea_caches(facial_recordings_path, rebuild=True)
+        return sum(len(module.load_fea_recording(csv_file_path).timestamps)
+                   for csv_file_path in facial_recordings_path.glob('*/faceexpressions.csv'))
+    if stage == 'fea_selection':
+        output_path = work_dir / 'emoji-hero-vr-db-facial-expression-activations'
+        shutil.rmtree(output_path, ignore_errors=True)
+        importlib.import_module('4_select_facial_expression_activations').find_and_save_expression_weights(
+            work_dir / 'images-224', facial_recordings_path)
+        return count_files(work_dir / 'images-224', '*-0.jpg')
+    if stage == 'csv_export':
+        module = importlib.import_module('5_facial_expression_activations_to_csv')
+        base_directory = work_dir / 'emoji-hero-vr-db-facial-expression-activations'
+        output_dir = work_dir / 'facial-expression-activations-as-csv'
+        output_dir.mkdir(exist_ok=True)
+        for subset_dir in base_directory.iterdir():
+            if subset_dir.is_dir():
+                module.save_to_csv(*module.load_data(subset_dir), output_dir / f'{subset_dir.name}.csv')
+        return count_files(base_directory, '*.json')
+    raise ValueError(f'Unknown stage: {stage}')
+
+
+def measure_stage(stage, work_dir, workers, result_path):
+    """Runs a stage and writes its measurements to result_path. Called in a fresh process by benchmark_stage."""
+    start_time = time.perf_counter()
+    items = run_stage(stage, work_dir, workers)
+    elapsed_time = time.perf_counter() - start_time
+
+    # On Linux, ru_maxrss is given in kilobytes
+    own_usage = resource.getrusage(resource.RUSAGE_SELF)
+    children_usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    result = {
+        'stage': stage,
+        'items': items,
+        'wall_time_s': elapsed_time,
+        'cpu_time_s': own_usage.ru_utime + own_usage.ru_stime + children_usage.ru_utime + children_usage.ru_stime,
+        'items_per_s': items / max(elapsed_time, 1e-9),
+        'max_rss_mb': own_usage.ru_maxrss / 1024,
+        'children_max_rss_mb': children_usage.ru_maxrss / 1024,
+    }
+    with open(result_path, mode='w', encoding='utf-8') as result_file:
+        json.dump(result, result_file)
+
+
+def benchmark_stage(stage, work_dir, workers):
+    log_dir = work_dir / 'logs'
+    log_dir.mkdir(parents=True, exist_ok=True)
+    result_path = log_dir / f'{stage}.json'
+    # The stages load files relative to this directory, e.g., the face detection model
+    with open(log_dir / f'{stage}.log', mode='w', encoding='utf-8') as log_file:
+        subprocess.run([sys.executable, Path(__file__).name, '--stage', stage, '--work-dir', str(work_dir.resolve()),
+                        '--workers', str(workers), '--result', str(result_path.resolve())],
+                       cwd=Path(__file__).resolve().parent, stdout=log_file, stderr=subprocess.STDOUT, check=True)
+    with open(result_path, mode='r', encoding='utf-8') as result_file:
+        result = json.load(result_file)
+    print(f'{stage}: {result["items"]} items in {result["wall_time_s"]:.2f} s ({result["items_per_s"]:.1f} items/s), '
+          f'max RSS {result["max_rss_mb"]:.0f} MB')
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks the construction stages on synthetic recordings.')
+    parser.add_argument('--work-dir', type=Path, default=Path('benchmark'))
+    parser.add_argument('--output', type=Path, help='Defaults to <work-dir>/benchmark-<utc-time>.json.')
+    parser.add_argument('--participants', type=int, default=2)
+    parser.add_argument('--emoji-dirs-per-level', type=int, default=8)
+    parser.add_argument('--images-per-window', type=int, default=62)
+    parser.add_argument('--invalid-payload-rate', type=float, default=0.0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--workers', type=int, default=1, help='Worker processes of the crop stage.')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=STAGES)
+    parser.add_argument('--regenerate', action='store_true', help='Regenerate existing synthetic recordings.')
+    # Internal: run a single stage in this process
+    parser.add_argument('--stage', choices=STAGES, help=argparse.SUPPRESS)
+    parser.add_argument('--result', type=Path, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.stage is not None:
+        measure_stage(args.stage, args.work_dir, args.workers, args.result)
+        return
+
+    scale = {'participants': args.participants, 'emoji_dirs_per_level': args.emoji_dirs_per_level,
+             'images_per_window': args.images_per_window, 'invalid_payload_rate': args.invalid_payload_rate,
+             'seed': args.seed}
+    scale_path = args.work_dir / 'synthetic-recordings.json'
+    if args.regenerate or not scale_path.exists() or json.loads(scale_path.read_text(encoding='utf-8')) != scale:
+        # Never delete a directory that was not created by this script
+        if args.work_dir.exists() and not scale_path.exists() and any(args.work_dir.iterdir()):
+            parser.error(f'{args.work_dir} is not empty and contains no synthetic recordings')
+        shutil.rmtree(args.work_dir, ignore_errors=True)
+        args.work_dir.mkdir(parents=True)
+        start_time = time.perf_counter()
+        windows = generate_facial_recordings(args.work_dir, args.participants, args.emoji_dirs_per_level,
+                                             args.images_per_window, invalid_payload_rate=args.invalid_payload_rate,
+                                             seed=args.seed)
+        generate_dataset(args.work_dir / 'facial-recordings', windows, args.work_dir / 'dataset', args.seed)
+        print(f'Generated synthetic recordings in {time.perf_counter() - start_time:.2f} s')
+        scale_path.write_text(json.dumps(scale), encoding='utf-8')
+
+    report = {
+        'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'scale': scale,
+        'workers': args.workers,
+        'stages': [benchmark_stage(stage, args.work_dir, args.workers) for stage in args.stages],
+    }
+    output_path = args.output or args.work_dir / f'benchmark-{datetime.now(timezone.utc):%Y%m%dT%H%M%SZ}.json'
+    with open(output_path, mode='w', encoding='utf-8') as output_file:
+        json.dump(report, output_file, indent=2)
+    print(f'Saved benchmark to {output_path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,218 @@
+import csv
+import os
+import sqlite3
+from pathlib import Path, PurePosixPath
+
+from recording_catalog import parse_recording_name
+
+# All artifacts of EmoHeVRDB encode their metadata in their paths, e.g.,
+# facial-recordings/<participant-id>/Level <level-id>/<emoji-id>-<emotion-name>/<timestamp>-1.png,
+# <set-name>/<emotion-name>/<timestamp>-<set-id>-<participant-id>-<level-id>-<emoji-id>-<emotion-id>-<camera-index>.jpg
+# for EmoHeVRDB-SI or
+# <set-name>/<emotion-name>/<sequence-id>/<timestamp>-<set-id>-<participant-id>-<level-id>-<emoji-id>-<emotion-id>.json
+# for EmoHeVRDB-DFEA.
+# Instead of walking these trees and splitting file names in every script,
+# this catalog parses them once into a SQLite database, so statistics and subset selection become SQL queries.
+#
+# The table artifacts holds one row per file of every catalogued tree (raw recordings, images, FEA vectors),
+# the table labels one row per row of label.csv.
+# Each tree is catalogued under a dataset name, by default the name of its root directory.
+# Updates are incremental: the table directories stores the mtime of every visited directory.
+# Adding, removing or renaming an entry of a directory changes its mtime,
+# so directories with an unchanged mtime are neither listed nor parsed again.
+
+SET_NAMES = {0: 'training_set', 1: 'validation_set', 2: 'test_set'}
+
+ARTIFACT_COLUMNS = ['dataset', 'path', 'directory', 'suffix', 'set_id', 'participant_id', 'level_id', 'emoji_id',
+                    'emotion_id', 'emotion_name', 'camera_index', 'timestamp', 'sequence_id']
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS artifacts (
+    dataset TEXT NOT NULL,
+    path TEXT NOT NULL,
+    directory TEXT NOT NULL,
+    suffix TEXT NOT NULL,
+    set_id INTEGER,
+    participant_id INTEGER,
+    level_id INTEGER,
+    emoji_id INTEGER,
+    emotion_id INTEGER,
+    emotion_name TEXT,
+    camera_index INTEGER,
+    timestamp INTEGER,
+    sequence_id TEXT,
+    PRIMARY KEY (dataset, path)
+);
+CREATE INDEX IF NOT EXISTS artifacts_by_directory ON artifacts (dataset, directory);
+CREATE INDEX IF NOT EXISTS artifacts_by_participant ON artifacts (dataset, participant_id, timestamp);
+CREATE INDEX IF NOT EXISTS artifacts_by_set_and_emotion ON artifacts (dataset, set_id, emotion_id);
+CREATE TABLE IF NOT EXISTS directories (
+    dataset TEXT NOT NULL,
+    path TEXT NOT NULL,
+    parent TEXT,
+    mtime_ns INTEGER NOT NULL,
+    PRIMARY KEY (dataset, path)
+);
+CREATE TABLE IF NOT EXISTS labels (
+    participant_id INTEGER NOT NULL,
+    level_id INTEGER NOT NULL,
+    emoji_id INTEGER NOT NULL,
+    image TEXT NOT NULL,
+    timestamp INTEGER NOT NULL,
+    label TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS labels_by_participant ON labels (participant_id, timestamp);
+CREATE TABLE IF NOT EXISTS sources (
+    path TEXT PRIMARY KEY,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL
+);
+"""
+
+
+def get_default_catalog_path(root_path: Path) -> Path:
+    return root_path.parent / 'emoji-hero-vr-db-catalog.sqlite'
+
+
+def open_catalog(catalog_path: Path) -> sqlite3.Connection:
+    connection = sqlite3.connect(str(catalog_path))
+    connection.execute('PRAGMA journal_mode=WAL')
+    connection.executescript(SCHEMA)
+    return connection
+
+
+def parse_recording_path(relative_path: PurePosixPath):
+    """Parses <participant-id>/Level <level-id>/<emoji-id>-<emotion-name>/<timestamp>[-1].png, else None."""
+    if len(relative_path.parts) != 4:
+        return None
+    participant_dir, level_dir, emoji_dir, file_name = relative_path.parts
+    recording = parse_recording_name(file_name)
+    if recording is None or not participant_dir.isdigit() or not level_dir.startswith('Level') or '-' not in emoji_dir:
+        return None
+    timestamp, camera_index = recording
+    emoji_id, emotion_name = emoji_dir.split('-')[:2]
+    return {'participant_id': int(participant_dir), 'level_id': int(level_dir.split()[-1]), 'emoji_id': int(emoji_id),
+            'emotion_name': emotion_name, 'camera_index': camera_index, 'timestamp': timestamp}
+
+
+def parse_dataset_path(relative_path: PurePosixPath):
+    """
+    Parses <set-name>/<emotion-name>[/<sequence-id>]/<file-name> of the dataset trees, else None.
+    <file-name> is <timestamp>-<set-id>-<participant-id>-<level-id>-<emoji-id>-<emotion-id>[-<camera-index>].<suffix>,
+    i.e., with <camera-index> for images and without for FEA vectors.
+    """
+    if len(relative_path.parts) not in (3, 4):
+        return None
+    parts = relative_path.stem.split('-')
+    if len(parts) not in (6, 7) or not all(part.isdigit() for part in parts):
+        return None
+    values = list(map(int, parts))
+    return {'set_id': values[1], 'participant_id': values[2], 'level_id': values[3], 'emoji_id': values[4],
+            'emotion_id': values[5], 'emotion_name': relative_path.parts[1],
+            'camera_index': values[6] if len(values) == 7 else None, 'timestamp': values[0],
+            'sequence_id': relative_path.parts[2] if len(relative_path.parts) == 4 else None}
+
+
+def update_tree(connection: sqlite3.Connection, root_path: Path, parse, dataset: str = None) -> int:
+    """
+    Brings the artifacts of the tree below root_path up to date and returns the number of re-listed directories.
+    parse maps a file's path relative to root_path to a dict of artifact columns or None to skip the file.
+    """
+    dataset = dataset or root_path.name
+    stored_mtimes = dict(connection.execute('SELECT path, mtime_ns FROM directories WHERE dataset = ?', (dataset,)))
+    stored_children = {}
+    for parent, path in connection.execute('SELECT parent, path FROM directories WHERE dataset = ?', (dataset,)):
+        stored_children.setdefault(parent, []).append(path)
+
+    visited = set()
+    number_of_listed_directories = 0
+    stack = [('.', None)]
+    with connection:
+        while stack:
+            relative_dir, parent = stack.pop()
+            dir_path = root_path if relative_dir == '.' else root_path / relative_dir
+            try:
+                mtime_ns = os.stat(dir_path).st_mtime_ns
+            except FileNotFoundError:
+                continue
+            visited.add(relative_dir)
+
+            if stored_mtimes.get(relative_dir) == mtime_ns:
+                stack.extend((child, relative_dir) for child in stored_children.get(relative_dir, []))
+                continue
+
+            number_of_listed_directories += 1
+            rows = []
+            with os.scandir(dir_path) as entries:
+                for entry in entries:
+                    relative_path = PurePosixPath(entry.name if relative_dir == '.' else f'{relative_dir}/{entry.name}')
+                    if entry.is_dir():
+                        stack.append((str(relative_path), relative_dir))
+                    elif entry.is_file():
+                        metadata = parse(relative_path)
+                        if metadata is not None:
+                            row = {'dataset': dataset, 'path': str(relative_path), 'directory': relative_dir,
+                                   'suffix': relative_path.suffix, **metadata}
+                            rows.append([row.get(column) for column in ARTIFACT_COLUMNS])
+
+            connection.execute('DELETE FROM artifacts WHERE dataset = ? AND directory = ?', (dataset, relative_dir))
+            connection.executemany(f'INSERT INTO artifacts VALUES ({", ".join("?" * len(ARTIFACT_COLUMNS))})', rows)
+            connection.execute('INSERT OR REPLACE INTO directories VALUES (?, ?, ?, ?)',
+                               (dataset, relative_dir, parent, mtime_ns))
+
+        for relative_dir in stored_mtimes.keys() - visited:
+            connection.execute('DELETE FROM artifacts WHERE dataset = ? AND directory = ?', (dataset, relative_dir))
+            connection.execute('DELETE FROM directories WHERE dataset = ? AND path = ?', (dataset, relative_dir))
+
+    return number_of_listed_directories
+
+
+def update_labels(connection: sqlite3.Connection, label_csv_path: Path) -> bool:
+    """Reloads the rows of label.csv if its mtime or size changed and returns whether it was reloaded."""
+    stat = os.stat(label_csv_path)
+    source = (str(label_csv_path), stat.st_mtime_ns, stat.st_size)
+    if connection.execute('SELECT * FROM sources WHERE path = ?', (source[0],)).fetchone() == source:
+        return False
+
+    with open(label_csv_path, mode='r', newline='') as label_file:
+        rows = [(int(row['participant']), int(row['level']), int(row['emoji']), row['image'],
+                 int(Path(row['image']).stem), row['label']) for row in csv.DictReader(label_file, delimiter=';')]
+    with connection:
+        connection.execute('DELETE FROM labels')
+        connection.executemany('INSERT INTO labels VALUES (?, ?, ?, ?, ?, ?)', rows)
+        connection.execute('INSERT OR REPLACE INTO sources VALUES (?, ?, ?)', source)
+    return True
+
+
+def update_catalog(catalog_path: Path,
+                   facial_recordings_path: Path = None,
+                   dataset_paths=(),
+                   label_csv_path: Path = None) -> sqlite3.Connection:
+    """Brings the catalog up to date with all given trees and label.csv and returns the open connection."""
+    connection = open_catalog(catalog_path)
+    if facial_recordings_path is not None:
+        listed = update_tree(connection, facial_recordings_path, parse_recording_path)
+        print(f'Updated {facial_recordings_path} in the catalog, re-listed {listed} directories')
+    for dataset_path in dataset_paths:
+        listed = update_tree(connection, dataset_path, parse_dataset_path)
+        print(f'Updated {dataset_path} in the catalog, re-listed {listed} directories')
+    if label_csv_path is not None and update_labels(connection, label_csv_path):
+        print(f'Reloaded {label_csv_path} into the catalog')
+    return connection
+
+
+if __name__ == '__main__':
+    emojihero_path = Path(r'/media/thor/PortableSSD1/mydata/emojihero')
+    dataset_path = Path(r'/media/thor/PortableSSD/emoji-hero-vr-db/dataset/emoji-hero-vr-db')
+    connection = update_catalog(
+        get_default_catalog_path(dataset_path),
+        facial_recordings_path=emojihero_path / 'participant-data' / 'facial-recordings',
+        dataset_paths=[dataset_path / name for name in ['emoji-hero-vr-db-si', 'emoji-hero-vr-db-di',
+                                                        'emoji-hero-vr-db-sfea', 'emoji-hero-vr-db-dfea']],
+        label_csv_path=Path(__file__).parent.parent / 'a_training_validation_and_test_split' / 'label.csv')
+
+    for dataset, set_id, emotion_name, count in connection.execute(
+            'SELECT dataset, set_id, emotion_name, COUNT(*) FROM artifacts '
+            'WHERE set_id IS NOT NULL AND camera_index IS NOT 1 GROUP BY dataset, set_id, emotion_name'):
+        print(f'{dataset} {SET_NAMES[set_id]} {emotion_name}: {count}')
+    connection.close()
@@ -0,0 +1,108 @@
+import math
+
+import cv2
+import mediapipe as mp
+import numpy as np
+
+from face_detection_cache import FaceDetectionCache, get_detector_key, hash_bytes
+
+BaseOptions = mp.tasks.BaseOptions
+FaceDetector = mp.tasks.vision.FaceDetector
+FaceDetectorOptions = mp.tasks.vision.FaceDetectorOptions
+VisionRunningMode = mp.tasks.vision.RunningMode
+
+MODEL_PATH = 'blaze_face_short_range.tflite'
+MIN_DETECTION_CONFIDENCE = 0.1
+
+# Each worker process creates its own FaceDetector (and detection cache) once in init_worker
+# and reuses it for all of its images
+worker_face_detector = None
+worker_detection_cache = None
+
+
+def is_plausible(detection):
+    face_width = detection.bounding_box.width
+    face_height = detection.bounding_box.height
+    aspect_ratio = face_height / face_width
+    return face_height >= 150 and face_width >= 150 and 0.5 <= aspect_ratio <= 2
+
+
+def create_face_detector():
+    options = FaceDetectorOptions(
+        base_options=BaseOptions(model_asset_path=MODEL_PATH),
+        min_detection_confidence=MIN_DETECTION_CONFIDENCE,
+        running_mode=VisionRunningMode.IMAGE)
+    return FaceDetector.create_from_options(options)
+
+
+def open_detection_cache(detection_cache_path):
+    detector_key = get_detector_key(MODEL_PATH, min_detection_confidence=MIN_DETECTION_CONFIDENCE)
+    return FaceDetectionCache(detection_cache_path, detector_key)
+
+
+def init_worker(detection_cache_path=None):
+    global worker_face_detector, worker_detection_cache
+    worker_face_detector = create_face_detector()
+    if detection_cache_path is not None:
+        worker_detection_cache = open_detection_cache(detection_cache_path)
+
+
+def get_worker_face_detector():
+    return worker_face_detector
+
+
+def get_worker_detection_cache():
+    return worker_detection_cache
+
+
+def read_image(img_path):
+    """Reads an image unchanged (i.e., BGRA for the original recordings) together with the hash of its content."""
+    data = img_path.read_bytes()
+    np_image = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+    return np_image, hash_bytes(data)
+
+
+def crop_face(np_image, face_detection, detection_cache=None, content_hash=None):
+    """
+    Crops an already decoded BGRA image of an original recording (1280x720) to the most plausible face.
+    If a detection_cache is given, the detection result is looked up by content_hash and only computed on a miss.
+    """
+    ih, iw, _ = np_image.shape
+    mp_image = mp.Image(image_format=mp.ImageFormat.SRGBA, data=np_image)
+    if detection_cache is None:
+        results = face_detection.detect(mp_image)
+    else:
+        results = detection_cache.get_or_detect(content_hash, lambda: face_detection.detect(mp_image))
+
+    if results.detections:
+        detections = [detection for detection in results.detections if is_plausible(detection)]
+        if detections:
+            detection = max(detections, key=lambda det: det.categories[0].score)
+            bbox = detection.bounding_box
+            x, y, w, h = bbox.origin_x, bbox.origin_y, bbox.width, bbox.height
+
+            center_x = x + w / 2
+            center_y = y + h / 2 - h / 5
+
+            crop_width = min(max(w * 1.8, 400), 720)  # these numbers are heuristics
+            crop_height = min(max(h * 1, 8, 400), 720)  # these numbers are heuristics
+            crop_size = max(crop_width, crop_height)
+
+            new_x = max(center_x - crop_size / 2, 0)
+            new_y = max(center_y - crop_size / 2, 0)
+            if new_x + crop_size > iw:
+                new_x = iw - crop_size
+            if new_y + crop_size > ih:
+                new_y = ih - crop_size
+
+            new_x = math.floor(max(new_x, 0))
+            new_y = math.floor(max(new_y, 0))
+
+            return np_image[int(new_y):int(new_y + crop_size), int(new_x):int(new_x + crop_size)]
+
+    print("No plausible face detected")
+    start_x = (iw - 600) // 2
+    end_x = start_x + 600
+    start_y = (ih - 600) // 2
+    end_y = start_y + 600
+    return np_image[start_y:end_y, start_x:end_x]
@@ -0,0 +1,93 @@
+import hashlib
+import json
+import sqlite3
+from pathlib import Path
+from types import SimpleNamespace
+
+# Face detection is the expensive part of occluding, cropping and selecting images,
+# while the geometry applied afterwards is cheap.
+# This cache persists detection results in a SQLite database, so re-runs with, e.g., a different occlusion ratio or
+# crop padding only pay for the geometry.
+# Entries are keyed by the SHA-256 of the image file's content and a detector key,
+# which identifies the detector model (by the SHA-256 of its file) and its settings.
+# All detections are cached, not only the plausible ones, so the plausibility heuristics can be changed as well.
+# The same module is used by
+# iii_study_preparation/b_facial_expression_recognition_model/occlude_images.py,
+# v_data_annotation/a_procedure/select_best_guesses.py and
+# vi_database_construction/b_construction_and_statistics/face_cropping.py,
+# so all of them can share one cache file.
+
+
+def hash_bytes(data: bytes) -> str:
+    return hashlib.sha256(data).hexdigest()
+
+
+def get_detector_key(model_path: str, **settings) -> str:
+    model_hash = hash_bytes(Path(model_path).read_bytes())[:16]
+    return f'{Path(model_path).name}:{model_hash}:{json.dumps(settings, sort_keys=True)}'
+
+
+def detection_result_to_json(detection_result) -> list:
+    """Converts a MediaPipe FaceDetectorResult to a JSON-serializable list of detections."""
+    return [{
+        'bounding_box': [detection.bounding_box.origin_x, detection.bounding_box.origin_y,
+                         detection.bounding_box.width, detection.bounding_box.height],
+        'score': detection.categories[0].score,
+        'keypoints': [[keypoint.x, keypoint.y] for keypoint in detection.keypoints or []],
+    } for detection in detection_result.detections or []]
+
+
+def detection_result_from_json(detections: list) -> SimpleNamespace:
+    """
+    Restores a cached detection result.
+    The returned objects provide the same attributes as MediaPipe's FaceDetectorResult,
+    i.e., detections[i].bounding_box.origin_x, detections[i].categories[0].score and detections[i].keypoints[j].x.
+    """
+    return SimpleNamespace(detections=[SimpleNamespace(
+        bounding_box=SimpleNamespace(origin_x=detection['bounding_box'][0], origin_y=detection['bounding_box'][1],
+                                     width=detection['bounding_box'][2], height=detection['bounding_box'][3]),
+        categories=[SimpleNamespace(score=detection['score'])],
+        keypoints=[SimpleNamespace(x=x, y=y) for x, y in detection['keypoints']],
+    ) for detection in detections])
+
+
+class FaceDetectionCache:
+    """
+    A detection cache for a single detector key.
+    SQLite connections must not be shared between processes, so each worker process opens its own cache.
+    """
+
+    def __init__(self, cache_path: Path, detector_key: str):
+        self.detector_key = detector_key
+        self.connection = sqlite3.connect(str(cache_path), timeout=60)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS detections ('
+                                'content_hash TEXT NOT NULL, '
+                                'detector_key TEXT NOT NULL, '
+                                'result TEXT NOT NULL, '
+                                'PRIMARY KEY (content_hash, detector_key))')
+        self.connection.commit()
+
+    def get(self, content_hash: str):
+        row = self.connection.execute('SELECT result FROM detections WHERE content_hash = ? AND detector_key = ?',
+                                      (content_hash, self.detector_key)).fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def put(self, content_hash: str, result) -> None:
+        with self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO detections VALUES (?, ?, ?)',
+                                    (content_hash, self.detector_key, json.dumps(result)))
+
+    def get_or_detect(self, content_hash: str, detect):
+        """Returns the cached detection result or calls detect() and caches the FaceDetectorResult it returns."""
+        cached_detections = self.get(content_hash)
+        if cached_detections is not None:
+            return detection_result_from_json(cached_detections)
+
+        detection_result = detect()
+        self.put(content_hash, detection_result_to_json(detection_result))
+        return detection_result
+
+    def close(self) -> None:
+        self.connection.close()
@@ -0,0 +1,443 @@
+import itertools
+import json
+import re
+import shutil
+from collections import namedtuple
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pa_csv
+
+# faceexpressions.csv row convention:
+# <timestamp>;<level>;<unused>;<unused>;<JSON object containing the 63 'ExpressionWeights'>
+# Parsing the JSON payloads dominates every script reading these files.
+# Therefore, we convert each participant's faceexpressions.csv once into a columnar cache of NumPy arrays,
+# which all scripts can memory-map instantly:
+#
+# faceexpressions-cache
+# ├── timestamps.npy  (N,)    int64,   sorted ascending
+# ├── levels.npy      (N,)    int8,    index into level_names in meta.json
+# ├── weights.npy     (N, 63) float32, all NaN for rows with an invalid payload
+# ├── meta.json               level_names, the number of repaired and invalid rows and the mtime/size of the source csv
+#
+# Even the conversion does not call json.loads for every row.
+# Split at ',' instead of ';', a row with a well-formed payload has exactly 63 fields:
+# <timestamp>;<level>;<unused>;<unused>;{"ExpressionWeights": [<weight>  |  <weight>  | ... |  <weight>]}
+# iter_fea_chunks streams the csv block by block through the Arrow csv reader, which parses the 61 inner fields
+# as numbers, and only checks the first and the last field with regular expressions.
+# Rows with another number of fields (e.g., truncated or concatenated payloads) are decoded with json.loads.
+#
+# Some payloads are malformed, e.g., dozens of rows of participant 7 are truncated or concatenated JSON objects.
+# If such a payload still contains a complete array of 63 weights after '{"ExpressionWeights": ',
+# the first of these arrays is used (see repair_expression_weights), otherwise the row is cached as invalid.
+
+NUMBER_OF_FEAS = 63
+CACHE_VERSION = 3
+CHUNK_BYTES = 1 << 24
+CHUNK_ROWS = 65536
+
+# Including NaN, Infinity and -Infinity, which json.loads accepts as well
+JSON_NUMBER = r'(?:-?\d+(?:\.\d+)?(?:[eE][+-]?\d+)?|NaN|-?Infinity)'
+FIRST_FIELD_PATTERN = r'^(?P<timestamp>[^;]*);(?P<level>[^;]*);[^;]*;[^;]*;(?P<payload>.*)$'
+PAYLOAD_HEAD_PATTERN = rf'^\s*\{{\s*"ExpressionWeights"\s*:\s*\[\s*(?P<weight>{JSON_NUMBER})\s*$'
+PAYLOAD_TAIL_PATTERN = rf'^\s*(?P<weight>{JSON_NUMBER})\s*\]\s*\}}\s*$'
+# The first and last field of a row with 63 fields whose array of weights can be repaired
+REPAIRABLE_PAYLOAD_HEAD_PATTERN = rf'\{{\s*"ExpressionWeights"\s*:\s*\[\s*(?P<weight>{JSON_NUMBER})\s*$'
+REPAIRABLE_PAYLOAD_TAIL_PATTERN = rf'^\s*(?P<weight>{JSON_NUMBER})\s*\]'
+EXPRESSION_WEIGHTS_START_PATTERN = re.compile(r'\{\s*"ExpressionWeights"\s*:\s*\[')
+
+FeaRecording = namedtuple('FeaRecording',
+                          ['timestamps', 'levels', 'level_names', 'weights', 'repaired_rows', 'invalid_rows'])
+# The rows of a faceexpressions.csv in file order, levels holds the level names, weights is NaN for invalid payloads
+FeaChunk = namedtuple('FeaChunk', ['timestamps', 'levels', 'weights', 'repaired_rows', 'invalid_rows'])
+
+
+def get_cache_dir(csv_file_path: Path) -> Path:
+    return csv_file_path.with_name(f'{csv_file_path.stem}-cache')
+
+
+def get_source_signature(csv_file_path: Path) -> dict:
+    stat = csv_file_path.stat()
+    return {'version': CACHE_VERSION, 'mtime_ns': stat.st_mtime_ns, 'size': stat.st_size}
+
+
+def is_cache_up_to_date(csv_file_path: Path) -> bool:
+    meta_path = get_cache_dir(csv_file_path) / 'meta.json'
+    if not meta_path.exists():
+        return False
+    with open(meta_path, mode='r', encoding='utf-8') as meta_file:
+        meta = json.load(meta_file)
+    return meta.get('source') == get_source_signature(csv_file_path)
+
+
+def are_expression_weights(expression_weights) -> bool:
+    """
+    Whether a decoded JSON value is a list of 63 numbers, i.e., neither null, booleans, strings nor NaN.
+    NaN is rejected as the Arrow csv reader reads it as null, so both decoders agree on every row.
+    """
+    return (type(expression_weights) is list and len(expression_weights) == NUMBER_OF_FEAS
+            and all(type(weight) in (int, float) and weight == weight for weight in expression_weights))
+
+
+def parse_expression_weights(payload: str):
+    """Returns the 63 expression weights of a JSON payload or None if the payload is invalid."""
+    try:
+        expression_weights = json.loads(payload)['ExpressionWeights']
+    except (json.JSONDecodeError, KeyError, TypeError):
+        return None
+    if not are_expression_weights(expression_weights):
+        return None
+    return expression_weights
+
+
+def repair_expression_weights(payload: str):
+    """
+    Returns the first complete array of 63 expression weights in a malformed payload or None,
+    e.g., for '{"ExpressionWeights": [...]' (truncated) or '{"ExpressionWeights": [...]}{"ExpressionWei' (concatenated).
+    """
+    for match in EXPRESSION_WEIGHTS_START_PATTERN.finditer(payload):
+        end = payload.find(']', match.end())
+        if end == -1:
+            return None
+        try:
+            expression_weights = json.loads(payload[match.end() - 1:end + 1])
+        except json.JSONDecodeError:
+            continue
+        if are_expression_weights(expression_weights):
+            return expression_weights
+    return None
+
+
+def expression_weights_to_list(expression_weights: np.ndarray) -> list:
+    """
+    Converts a cached float32 row back to a list of Python floats.
+    Going through the shortest float32 representation keeps the values as they were written by the headset,
+    e.g., 0.1 instead of 0.10000000149011612.
+    """
+    return [float(str(weight)) for weight in expression_weights]
+
+
+def decode_rows(lines) -> FeaChunk:
+    """Decodes complete rows of a faceexpressions.csv with json.loads."""
+    timestamps = np.empty(len(lines), dtype=np.int64)
+    levels = np.empty(len(lines), dtype=object)
+    weights = np.empty((len(lines), NUMBER_OF_FEAS), dtype=np.float32)
+    repaired_rows = 0
+    invalid_rows = 0
+    for row, line in enumerate(lines):
+        timestamp, level, _, _, payload = line.rstrip('\r\n').split(';', 4)
+        expression_weights = parse_expression_weights(payload)
+        if expression_weights is None:
+            expression_weights = repair_expression_weights(payload)
+            if expression_weights is None:
+                invalid_rows += 1
+                expression_weights = np.nan
+            else:
+                repaired_rows += 1
+        timestamps[row] = int(timestamp)
+        levels[row] = level
+        weights[row] = expression_weights
+    return FeaChunk(timestamps, levels, weights, repaired_rows, invalid_rows)
+
+
+def decode_batch(batch: pa.RecordBatch) -> FeaChunk:
+    """Decodes a batch of the Arrow csv reader, i.e., of rows with 63 fields when split at ','."""
+    first_field = pc.extract_regex(batch.column(0), FIRST_FIELD_PATTERN)
+    if first_field.null_count:
+        raise ValueError('Found a row without a timestamp, level and payload')
+    payload_head = pc.struct_field(first_field, 'payload')
+    payload_tail = batch.column(NUMBER_OF_FEAS - 1)
+    # The repairable patterns capture the same weights as the strict ones if those match
+    head = pc.extract_regex(payload_head, REPAIRABLE_PAYLOAD_HEAD_PATTERN)
+    tail = pc.extract_regex(payload_tail, REPAIRABLE_PAYLOAD_TAIL_PATTERN)
+
+    # Like np.array(json.loads(...), dtype=np.float32), i.e., parsed as float64 and then rounded to float32
+    weights = np.empty((len(batch), NUMBER_OF_FEAS), dtype=np.float32)
+    weights[:, 0] = pc.cast(pc.struct_field(head, 'weight'), pa.float64()).to_numpy(zero_copy_only=False)
+    for index in range(1, NUMBER_OF_FEAS - 1):
+        weights[:, index] = batch.column(index).to_numpy(zero_copy_only=False)
+    weights[:, -1] = pc.cast(pc.struct_field(tail, 'weight'), pa.float64()).to_numpy(zero_copy_only=False)
+
+    # Rows with an empty field or without a repairable start and end of the payload are invalid
+    valid = pc.and_(head.is_valid(), tail.is_valid())
+    for column in batch.columns[1:-1]:
+        if column.null_count:
+            valid = pc.and_(valid, column.is_valid())
+    # NaN in the first or last field is captured by the patterns, but is invalid like an inner NaN (read as null)
+    invalid = ~valid.to_numpy(zero_copy_only=False) | np.isnan(weights).any(axis=1)
+    weights[invalid] = np.nan
+    well_formed = pc.and_(pc.match_substring_regex(payload_head, PAYLOAD_HEAD_PATTERN),
+                          pc.match_substring_regex(payload_tail, PAYLOAD_TAIL_PATTERN))
+    repaired = ~invalid & ~well_formed.to_numpy(zero_copy_only=False)
+
+    return FeaChunk(
+        timestamps=pc.cast(pc.struct_field(first_field, 'timestamp'), pa.int64()).to_numpy(),
+        levels=pc.struct_field(first_field, 'level').to_numpy(zero_copy_only=False),
+        weights=weights,
+        repaired_rows=int(repaired.sum()),
+        invalid_rows=int(invalid.sum()),
+    )
+
+
+def interleave_chunks(chunk, other_chunk, is_other) -> FeaChunk:
+    """Merges the rows of two chunks, is_other marks the positions of other_chunk's rows."""
+    def interleave(values, other_values):
+        merged = np.empty((len(is_other), *values.shape[1:]), dtype=values.dtype)
+        merged[~is_other] = values
+        merged[is_other] = other_values
+        return merged
+
+    return FeaChunk(
+        timestamps=interleave(chunk.timestamps, other_chunk.timestamps),
+        levels=interleave(chunk.levels, other_chunk.levels),
+        weights=interleave(chunk.weights, other_chunk.weights),
+        repaired_rows=chunk.repaired_rows + other_chunk.repaired_rows,
+        invalid_rows=chunk.invalid_rows + other_chunk.invalid_rows,
+    )
+
+
+def iter_json_chunks(csv_file_path: Path, first_row_number: int = 1, chunk_rows: int = CHUNK_ROWS):
+    """Like iter_fea_chunks, but decodes every row with json.loads, starting at the (1-based) non-empty row."""
+    with open(csv_file_path, mode='r', encoding='utf-8') as csv_file:
+        lines = (line for line in csv_file if line.rstrip('\r\n'))
+        lines = itertools.islice(lines, first_row_number - 1, None)
+        while True:
+            chunk_lines = list(itertools.islice(lines, chunk_rows))
+            if not chunk_lines:
+                return
+            yield decode_rows(chunk_lines)
+
+
+def iter_fea_chunks(csv_file_path: Path, block_size: int = CHUNK_BYTES):
+    """
+    Yields the rows of a faceexpressions.csv in file order as FeaChunks of about block_size bytes of the csv,
+    so arbitrarily large recordings are decoded in bounded memory.
+    """
+    # Rows without 63 fields by their number, counting non-empty rows from 1 like the Arrow csv reader
+    other_rows = {}
+
+    def handle_other_row(row):
+        other_rows[row.number] = row.text
+        return 'skip'
+
+    column_names = [f'f{index}' for index in range(NUMBER_OF_FEAS)]
+    column_types = {column_name: pa.float64() for column_name in column_names}
+    column_types.update({column_names[0]: pa.string(), column_names[-1]: pa.string()})
+    reader = None
+    next_row_number = 1
+    while True:
+        try:
+            # Opening already reads the first block
+            if reader is None:
+                reader = pa_csv.open_csv(
+                    csv_file_path,
+                    read_options=pa_csv.ReadOptions(column_names=column_names, block_size=block_size,
+                                                    use_threads=False),
+                    parse_options=pa_csv.ParseOptions(delimiter=',', quote_char=False,
+                                                      invalid_row_handler=handle_other_row),
+                    convert_options=pa_csv.ConvertOptions(column_types=column_types))
+            batch = reader.read_next_batch()
+        except StopIteration:
+            break
+        except pa.ArrowInvalid:
+            # An inner field is not a number, let json decide about each remaining row
+            yield from iter_json_chunks(csv_file_path, next_row_number)
+            return
+
+        # The batch's rows are the next rows with 63 fields, interleaved with the other rows skipped meanwhile
+        end_row_number = next_row_number + len(batch)
+        other_row_numbers = []
+        for row_number in sorted(other_rows):
+            if row_number >= end_row_number:
+                break
+            other_row_numbers.append(row_number)
+            end_row_number += 1
+
+        chunk = decode_batch(batch)
+        if other_row_numbers:
+            other_chunk = decode_rows([other_rows.pop(row_number) for row_number in other_row_numbers])
+            is_other = np.zeros(end_row_number - next_row_number, dtype=bool)
+            is_other[np.array(other_row_numbers) - next_row_number] = True
+            chunk = interleave_chunks(chunk, other_chunk, is_other)
+        next_row_number = end_row_number
+        yield chunk
+
+    if other_rows:
+        yield decode_rows([other_rows[row_number] for row_number in sorted(other_rows)])
+
+
+def build_fea_cache(csv_file_path: Path) -> Path:
+    level_names = []
+    chunks = []
+    repaired_rows = 0
+    invalid_rows = 0
+
+    for chunk in iter_fea_chunks(csv_file_path):
+        # Level codes in the order in which the levels first appear in the csv
+        chunk_level_names, first_rows, codes = np.unique(chunk.levels.astype(str), return_index=True,
+                                                         return_inverse=True)
+        for level in chunk_level_names[np.argsort(first_rows)]:
+            if level not in level_names:
+                level_names.append(str(level))
+        level_code_of = np.array([level_names.index(level) for level in chunk_level_names], dtype=np.int8)
+        chunks.append((chunk.timestamps, level_code_of[codes].reshape(-1), chunk.weights))
+        repaired_rows += chunk.repaired_rows
+        invalid_rows += chunk.invalid_rows
+
+    timestamps = np.concatenate([np.empty(0, dtype=np.int64)] + [chunk[0] for chunk in chunks])
+    level_codes = np.concatenate([np.empty(0, dtype=np.int8)] + [chunk[1] for chunk in chunks])
+    weights = np.concatenate([np.empty((0, NUMBER_OF_FEAS), dtype=np.float32)] + [chunk[2] for chunk in chunks])
+    del chunks
+
+    # A stable sort keeps rows with equal timestamps in their file order
+    order = np.argsort(timestamps, kind='stable')
+
+    # Write into a temporary directory first, so an interrupted build never leaves a half-written cache behind
+    cache_dir = get_cache_dir(csv_file_path)
+    tmp_dir = cache_dir.with_name(f'{cache_dir.name}.tmp')
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    tmp_dir.mkdir(parents=True)
+
+    np.save(tmp_dir / 'timestamps.npy', timestamps[order])
+    np.save(tmp_dir / 'levels.npy', level_codes[order])
+    np.save(tmp_dir / 'weights.npy', weights[order])
+    with open(tmp_dir / 'meta.json', mode='w', encoding='utf-8') as meta_file:
+        json.dump({
+            'source': get_source_signature(csv_file_path),
+            'level_names': level_names,
+            'repaired_rows': repaired_rows,
+            'invalid_rows': invalid_rows,
+        }, meta_file)
+
+    shutil.rmtree(cache_dir, ignore_errors=True)
+    tmp_dir.rename(cache_dir)
+    print(f'Cached {len(timestamps)} rows ({repaired_rows} repaired, {invalid_rows} invalid) of {csv_file_path} '
+          f'in {cache_dir}')
+    return cache_dir
+
+
+def load_fea_recording(csv_file_path: Path, rebuild: bool = False) -> FeaRecording:
+    """
+    Memory-maps the cached columns of a faceexpressions.csv.
+    The cache is (re)built if it does not exist yet or the csv's mtime or size changed.
+    """
+    if rebuild or not is_cache_up_to_date(csv_file_path):
+        build_fea_cache(csv_file_path)
+
+    cache_dir = get_cache_dir(csv_file_path)
+    with open(cache_dir / 'meta.json', mode='r', encoding='utf-8') as meta_file:
+        meta = json.load(meta_file)
+
+    return FeaRecording(
+        timestamps=np.load(cache_dir / 'timestamps.npy', mmap_mode='r'),
+        levels=np.load(cache_dir / 'levels.npy', mmap_mode='r'),
+        level_names=meta['level_names'],
+        weights=np.load(cache_dir / 'weights.npy', mmap_mode='r'),
+        repaired_rows=meta['repaired_rows'],
+        invalid_rows=meta['invalid_rows'],
+    )
+
+
+def align_to_valid_rows(recording: FeaRecording, timestamps, max_diff: int):
+    """
+    Finds the row closest to each of the timestamps within max_diff milliseconds that holds valid weights
+    (the earlier row on ties) with a single binary search over all timestamps.
+    Returns the row indices and the absolute differences in milliseconds, both -1 for timestamps without such a row.
+    """
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    indices = np.full(len(timestamps), -1, dtype=np.int64)
+    differences = np.full(len(timestamps), -1, dtype=np.int64)
+
+    # Rows with an invalid payload are cached as NaN
+    valid_rows = np.flatnonzero(~np.isnan(recording.weights).any(axis=1))
+    if len(valid_rows) == 0:
+        return indices, differences
+    valid_timestamps = np.asarray(recording.timestamps)[valid_rows]
+
+    # The first valid row at or after and the last valid row before each timestamp
+    after = np.searchsorted(valid_timestamps, timestamps, side='left')
+    before = after - 1
+    no_difference = np.iinfo(np.int64).max
+    difference_after = np.where(after < len(valid_rows),
+                                valid_timestamps[np.minimum(after, len(valid_rows) - 1)] - timestamps, no_difference)
+    difference_before = np.where(before >= 0, timestamps - valid_timestamps[np.maximum(before, 0)], no_difference)
+    # Of several rows with the same timestamp before, take the first one
+    before = np.searchsorted(valid_timestamps, valid_timestamps[np.maximum(before, 0)], side='left')
+
+    use_before = difference_before <= difference_after
+    nearest = np.where(use_before, before, after)
+    difference = np.where(use_before, difference_before, difference_after)
+    found = difference <= max_diff
+    indices[found] = valid_rows[nearest[found]]
+    differences[found] = difference[found]
+    return indices, differences
+
+
+def count_time_differences(differences, time_differences) -> dict:
+    """
+    Histogram of the differences returned by align_to_valid_rows over the ascending tolerances time_differences:
+    {<max_diff>: number of differences <= max_diff and > the previous max_diff}. Differences of -1 are ignored.
+    """
+    differences = np.asarray(differences)
+    tolerances = np.searchsorted(time_differences, differences[differences >= 0], side='left')
+    counts = np.bincount(tolerances, minlength=len(time_differences) + 1)
+    return {max_diff: int(count) for max_diff, count in zip(time_differences, counts)}
+
+
+def interpolate_valid_rows(recording: FeaRecording, timestamps, max_diff: int):
+    """
+    Linearly interpolates the weights at each of the timestamps between the last valid row before
+    and the first valid row at or after it, if the nearer of both rows is at most max_diff milliseconds apart
+    (as for align_to_valid_rows, so no timestamp aligned by the nearest row is lost).
+    Before the first and after the last valid row, the weights of that row are used.
+    Returns the float32 weights of shape (len(timestamps), 63), NaN for timestamps without such rows,
+    and the difference to the nearer of both rows in milliseconds, -1 for timestamps without such rows.
+    """
+    timestamps = np.asarray(timestamps, dtype=np.int64)
+    weights = np.full((len(timestamps), NUMBER_OF_FEAS), np.nan, dtype=np.float32)
+    differences = np.full(len(timestamps), -1, dtype=np.int64)
+
+    valid_rows = np.flatnonzero(~np.isnan(recording.weights).any(axis=1))
+    if len(valid_rows) == 0:
+        return weights, differences
+    valid_timestamps = np.asarray(recording.timestamps)[valid_rows]
+
+    # The first valid row at or after each timestamp and the last valid row before it,
+    # or the same row twice outside of the recording
+    after = np.searchsorted(valid_timestamps, timestamps, side='left')
+    before = np.maximum(after - 1, 0)
+    after = np.minimum(after, len(valid_rows) - 1)
+    before = np.where(valid_timestamps[after] < timestamps, after, before)
+    after = np.where(valid_timestamps[before] > timestamps, before, after)
+    # The row with exactly the timestamp is used as is
+    before = np.where(valid_timestamps[after] == timestamps, after, before)
+
+    difference = np.minimum(np.abs(timestamps - valid_timestamps[before]),
+                            np.abs(valid_timestamps[after] - timestamps))
+    found = difference <= max_diff
+    before, after, timestamps = before[found], after[found], timestamps[found]
+
+    gap = valid_timestamps[after] - valid_timestamps[before]
+    fraction = np.divide(timestamps - valid_timestamps[before], gap, out=np.zeros(len(gap)), where=gap > 0)
+    weights_before = np.asarray(recording.weights[valid_rows[before]], dtype=np.float64)
+    weights_after = np.asarray(recording.weights[valid_rows[after]], dtype=np.float64)
+    weights[found] = weights_before + fraction[:, None] * (weights_after - weights_before)
+    differences[found] = difference[found]
+    return weights, differences
+
+
+def build_all_fea_caches(facial_recordings_path: Path, rebuild: bool = False) -> None:
+    for participant_dir in sorted(facial_recordings_path.iterdir()):
+        csv_file_path = participant_dir / 'faceexpressions.csv'
+        if participant_dir.is_dir() and csv_file_path.exists():
+            if rebuild or not is_cache_up_to_date(csv_file_path):
+                build_fea_cache(csv_file_path)
+            else:
+                print(f'Cache of {csv_file_path} is up to date.')
+
+
+if __name__ == '__main__':
+    facial_recordings_path = Path(r'/media/thor/PortableSSD/mydata/emojihero/participant-data/facial-recordings')
+    build_all_fea_caches(facial_recordings_path)
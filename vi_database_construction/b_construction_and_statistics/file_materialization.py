@@ -0,0 +1,72 @@
+import os
+import shutil
+import sys
+from pathlib import Path
+
+# Reorganizing the dataset does not change the image files themselves.
+# Instead of copying tens of gigabytes of pngs on the same drive, the files can be materialized as
+# - 'hardlink': a second directory entry for the same file (same file system only),
+# - 'reflink': a copy-on-write clone sharing the data blocks (e.g., Btrfs, XFS, APFS),
+# - 'symlink': a link pointing to the original file,
+# - 'copy': a regular copy via shutil.copy2.
+# If the requested mode is not supported for a file, materialize_file falls back to 'copy'.
+# Note that a hardlinked file is the original file, i.e., modifying it in place also modifies the original.
+
+MATERIALIZATION_MODES = ('hardlink', 'reflink', 'symlink', 'copy')
+
+# ioctl request code of FICLONE on Linux, see linux/fs.h
+FICLONE = 0x40049409
+
+# Modes whose fallback to 'copy' was already reported, so a failing mode is not reported for every single file
+reported_fallbacks = set()
+
+
+def reflink(source_path: Path, dest_path: Path) -> None:
+    if sys.platform.startswith('linux'):
+        import fcntl
+        with open(source_path, 'rb') as source_file, open(dest_path, 'wb') as dest_file:
+            try:
+                fcntl.ioctl(dest_file.fileno(), FICLONE, source_file.fileno())
+            except OSError:
+                dest_file.close()
+                os.unlink(dest_path)
+                raise
+    elif sys.platform == 'darwin':
+        import ctypes
+        libc = ctypes.CDLL('libc.dylib', use_errno=True)
+        if libc.clonefile(os.fsencode(source_path), os.fsencode(dest_path), 0) != 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), str(source_path))
+    else:
+        raise OSError(f'Reflinks are not supported on {sys.platform}')
+
+
+def materialize_file(source_path: Path, dest_path: Path, mode: str = 'copy') -> str:
+    """
+    Materializes source_path at dest_path using the given mode, replacing an existing dest_path.
+    Returns the mode that was actually used, which is 'copy' if the requested mode failed.
+    """
+    if mode not in MATERIALIZATION_MODES:
+        raise ValueError(f'Unknown materialization mode {mode}, expected one of {MATERIALIZATION_MODES}')
+
+    # Always remove an existing dest_path first. Otherwise, copying onto a hardlink or symlink of a previous run
+    # would overwrite the original file.
+    if dest_path.is_symlink() or dest_path.exists():
+        dest_path.unlink()
+
+    if mode != 'copy':
+        try:
+            if mode == 'hardlink':
+                os.link(source_path, dest_path)
+            elif mode == 'reflink':
+                reflink(source_path, dest_path)
+            else:
+                os.symlink(Path(source_path).resolve(), dest_path)
+            return mode
+        except OSError as e:
+            if mode not in reported_fallbacks:
+                reported_fallbacks.add(mode)
+                print(f'Could not {mode} {source_path} to {dest_path} ({e}). Falling back to copy.')
+
+    shutil.copy2(source_path, dest_path)
+    return 'copy'
@@ -0,0 +1,204 @@
+import io
+import json
+import random
+import tarfile
+from pathlib import Path
+
+# Loading EmoHeVRDB-SI or -DI from its directory structure means opening thousands of small JPG files per epoch,
+# which is slow on network or USB storage.
+# Therefore, write_shards packs each set into a few large tar files (shards) that can be read sequentially:
+#
+# <output-path>
+# ├── <set-name>
+#     ├── shard-000000.tar
+#     ├── shard-000001.tar
+#     ├── index.json
+#
+# Each sample is stored as consecutive members sharing a key, as in the WebDataset format.
+# For EmoHeVRDB-SI, a sample is a single image:
+# <key>.jpg holds the encoded JPG bytes and <key>.json the metadata parsed from the image's path,
+# where <key> is the image's path relative to the set directory without its suffix.
+# For EmoHeVRDB-DI, a sample is a whole sequence, so its frames are never spread across shards:
+# <key>.<frame-index>.jpg holds the frames in temporal order and <key>.json the label, the sequence id and the
+# metadata of each frame, where <key> is <emotion-name>/<sequence-id>.
+# index.json lists the shard, byte offset and size of every image, so single images can be read without unpacking.
+# The samples are written in a shuffled order, so a shard does not only contain samples of a single emotion.
+
+SHARD_INDEX_VERSION = 2
+DEFAULT_SHARD_SIZE = 256 * 1024 * 1024
+TAR_BLOCK_SIZE = tarfile.BLOCKSIZE
+
+
+def parse_image_metadata(relative_path: Path) -> dict:
+    """
+    Parses the metadata of an image from its path relative to the set directory, i.e.,
+    <emotion-name>/<file-name> for EmoHeVRDB-SI and <emotion-name>/<sequence-id>/<file-name> for EmoHeVRDB-DI.
+    """
+    parts = relative_path.stem.split('-')
+    if len(parts) != 7:
+        raise ValueError(f'Unexpected filename format: {relative_path.name}')
+    timestamp, set_id, participant_id, level_id, emoji_id, emotion_id, camera_index = map(int, parts)
+
+    metadata = {
+        'path': relative_path.as_posix(),
+        'label': relative_path.parts[0],
+        'timestamp': timestamp,
+        'set_id': set_id,
+        'participant_id': participant_id,
+        'level_id': level_id,
+        'emoji_id': emoji_id,
+        'emotion_id': emotion_id,
+        'camera_index': camera_index,
+    }
+    if len(relative_path.parts) == 3:
+        metadata['sequence_id'] = relative_path.parts[1]
+    return metadata
+
+
+def add_member(tar: tarfile.TarFile, name: str, data: bytes) -> int:
+    """Adds data as member name to the tar file and returns the offset of the data within the tar file."""
+    tar_info = tarfile.TarInfo(name)
+    tar_info.size = len(data)
+    tar.addfile(tar_info, io.BytesIO(data))
+    # addfile leaves tar.offset at the end of the data, which is padded to full blocks
+    padded_size = (len(data) + TAR_BLOCK_SIZE - 1) // TAR_BLOCK_SIZE * TAR_BLOCK_SIZE
+    return tar.offset - padded_size
+
+
+def group_samples(set_path: Path) -> list:
+    """
+    Returns the samples below set_path as (<key>, [<relative-image-path>, ...]), i.e., one image per sample
+    for EmoHeVRDB-SI and all frames of a sequence directory, sorted by their timestamps, for EmoHeVRDB-DI.
+    """
+    samples = {}
+    for image_path in sorted(set_path.rglob('*.jpg')):
+        relative_path = image_path.relative_to(set_path)
+        if len(relative_path.parts) == 3:
+            key = relative_path.parent.as_posix()
+        else:
+            key = relative_path.with_suffix('').as_posix()
+        samples.setdefault(key, []).append(relative_path)
+    return [(key, sorted(relative_paths, key=lambda path: int(path.stem.split('-')[0])))
+            for key, relative_paths in samples.items()]
+
+
+def write_set_shards(set_path: Path, output_path: Path, shard_size: int = DEFAULT_SHARD_SIZE, seed: int = 0) -> None:
+    """Packs all samples below set_path into shards of about shard_size bytes and writes their index."""
+    samples = group_samples(set_path)
+    random.Random(seed).shuffle(samples)
+    output_path.mkdir(parents=True, exist_ok=True)
+
+    shard_names = []
+    index = []
+    tar = None
+    for key, relative_paths in samples:
+        if tar is None or tar.offset >= shard_size:
+            if tar is not None:
+                tar.close()
+            shard_names.append(f'shard-{len(shard_names):06d}.tar')
+            tar = tarfile.open(output_path / shard_names[-1], mode='w', format=tarfile.GNU_FORMAT)
+
+        frames = []
+        for frame_index, relative_path in enumerate(relative_paths):
+            metadata = parse_image_metadata(relative_path)
+            image_data = (set_path / relative_path).read_bytes()
+            member_name = f'{key}.jpg' if 'sequence_id' not in metadata else f'{key}.{frame_index:02d}.jpg'
+            offset = add_member(tar, member_name, image_data)
+            frames.append({'shard': shard_names[-1], 'offset': offset, 'size': len(image_data), **metadata})
+
+        if 'sequence_id' in frames[0]:
+            sample_metadata = {'key': key, 'label': frames[0]['label'], 'sequence_id': frames[0]['sequence_id'],
+                               'frames': [{name: value for name, value in frame.items()
+                                           if name not in ('shard', 'offset', 'size')} for frame in frames]}
+            index.append({'shard': shard_names[-1], 'key': key, 'label': sample_metadata['label'],
+                          'sequence_id': sample_metadata['sequence_id'], 'frames': frames})
+        else:
+            sample_metadata = {name: value for name, value in frames[0].items()
+                               if name not in ('shard', 'offset', 'size')}
+            index.append(frames[0])
+        add_member(tar, f'{key}.json', json.dumps(sample_metadata).encode('utf-8'))
+
+    if tar is not None:
+        tar.close()
+
+    with open(output_path / 'index.json', mode='w', encoding='utf-8') as index_file:
+        json.dump({'version': SHARD_INDEX_VERSION, 'shards': shard_names, 'samples': index}, index_file)
+    print(f'Packed {len(index)} samples from {set_path} into {len(shard_names)} shard(s) in {output_path}')
+
+
+def write_shards(input_path: Path, output_path: Path, shard_size: int = DEFAULT_SHARD_SIZE, seed: int = 0) -> None:
+    """Packs each set directory (training_set, validation_set, test_set) below input_path separately."""
+    for set_path in sorted(input_path.iterdir()):
+        if set_path.is_dir():
+            write_set_shards(set_path, output_path / set_path.name, shard_size, seed)
+
+
+def read_index(set_shards_path: Path) -> dict:
+    with open(set_shards_path / 'index.json', mode='r', encoding='utf-8') as index_file:
+        index = json.load(index_file)
+    if index.get('version') != SHARD_INDEX_VERSION:
+        raise ValueError(f'Unsupported shard index version {index.get("version")} in {set_shards_path}')
+    return index
+
+
+def read_image(set_shards_path: Path, entry: dict) -> bytes:
+    """
+    Reads the encoded JPG bytes of a single image, given its entry of index.json,
+    i.e., a sample of EmoHeVRDB-SI or one of the frames of a sample of EmoHeVRDB-DI.
+    """
+    with open(set_shards_path / entry['shard'], mode='rb') as shard_file:
+        shard_file.seek(entry['offset'])
+        return shard_file.read(entry['size'])
+
+
+def iterate_shard(shard_path: Path):
+    """
+    Reads a shard sequentially and yields (<jpg-bytes>, <metadata>) for each sample of EmoHeVRDB-SI
+    and ([<jpg-bytes>, ...], <metadata>) with the frames in temporal order for each sample of EmoHeVRDB-DI.
+    """
+    image_data = []
+    with tarfile.open(shard_path, mode='r|') as tar:
+        for member in tar:
+            data = tar.extractfile(member).read()
+            if member.name.endswith('.jpg'):
+                image_data.append(data)
+            elif member.name.endswith('.json'):
+                metadata = json.loads(data)
+                yield (image_data if 'frames' in metadata else image_data[0]), metadata
+                image_data = []
+
+
+def iterate_shards(set_shards_path: Path, shuffle_buffer_size: int = 0, seed: int = None):
+    """
+    Streams all samples of a set shard by shard and yields them like iterate_shard,
+    i.e., single images for EmoHeVRDB-SI and whole sequences for EmoHeVRDB-DI.
+    With shuffle_buffer_size > 0, the shard order is shuffled and the samples are shuffled
+    within a buffer of shuffle_buffer_size samples, i.e., without loading the whole set into memory.
+    """
+    shard_names = list(read_index(set_shards_path)['shards'])
+    if shuffle_buffer_size <= 0:
+        for shard_name in shard_names:
+            yield from iterate_shard(set_shards_path / shard_name)
+        return
+
+    rng = random.Random(seed)
+    rng.shuffle(shard_names)
+    buffer = []
+    for shard_name in shard_names:
+        for sample in iterate_shard(set_shards_path / shard_name):
+            if len(buffer) < shuffle_buffer_size:
+                buffer.append(sample)
+                continue
+            i = rng.randrange(shuffle_buffer_size)
+            yield buffer[i]
+            buffer[i] = sample
+
+    rng.shuffle(buffer)
+    yield from buffer
+
+
+if __name__ == '__main__':
+    base_directory = Path(r'/media/thor/PortableSSD/emoji-hero-vr-db/dataset/emoji-hero-vr-db')
+    for dataset_name in ['emoji-hero-vr-db-si', 'emoji-hero-vr-db-di']:
+        input_path = base_directory / dataset_name
+        write_shards(input_path, base_directory.parent / f'{dataset_name}-shards')
@@ -0,0 +1,120 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from image_shards import parse_image_metadata
+
+# At 224x224 pixels, EmoHeVRDB-SI is small enough to be kept decoded (about 530 MB),
+# yet training decodes every JPG again in every epoch.
+# Therefore, build_image_tensors decodes each set once into memory-mapped arrays:
+#
+# <output-path>
+# ├── <set-name>
+#     ├── images.npy           uint8, (N, 224, 224, 3) for EmoHeVRDB-SI, (N, 30, 224, 224, 3) for EmoHeVRDB-DI
+#     ├── labels.npy           int8, <emotion-id> of each image or sequence
+#     ├── participant_ids.npy  int16
+#     ├── metadata.json        the metadata parsed from the images' names, in the same order
+#
+# The images are stored in RGB order, as loaded by keras.preprocessing.image_dataset_from_directory.
+# load_image_tensors memory-maps images.npy, so only the accessed images are read from disk.
+
+IMAGE_SIZE = (224, 224)
+SEQUENCE_LENGTH = 30
+# The number of images a worker decodes per task
+CHUNK_SIZE = 64
+
+
+def decode_image(image_path: Path) -> np.ndarray:
+    image = cv2.imread(str(image_path), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError(f'Could not read image {image_path}')
+    if image.shape[:2] != IMAGE_SIZE:
+        raise ValueError(f'Expected an image of size {IMAGE_SIZE}, found {image.shape[:2]} for {image_path}')
+    return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+
+def find_samples(set_path: Path, sequences: bool) -> list:
+    """
+    Returns the image paths of each sample of a set, sorted by path.
+    A sample is a single image for EmoHeVRDB-SI and the 30 images of a sequence directory for EmoHeVRDB-DI.
+    """
+    if not sequences:
+        return [[image_path] for image_path in sorted(set_path.glob('*/*.jpg'))]
+
+    samples = []
+    for sequence_dir in sorted(path for path in set_path.glob('*/*') if path.is_dir()):
+        image_paths = sorted(sequence_dir.glob('*.jpg'))
+        if len(image_paths) != SEQUENCE_LENGTH:
+            raise ValueError(f'Expected {SEQUENCE_LENGTH} images in {sequence_dir}, found {len(image_paths)}')
+        samples.append(image_paths)
+    return samples
+
+
+def build_set_tensors(set_path: Path, output_path: Path, sequences: bool = False, workers: int = None) -> None:
+    samples = find_samples(set_path, sequences)
+    sample_shape = (SEQUENCE_LENGTH, *IMAGE_SIZE, 3) if sequences else (*IMAGE_SIZE, 3)
+
+    output_path.mkdir(parents=True, exist_ok=True)
+    images = np.lib.format.open_memmap(output_path / 'images.npy', mode='w+', dtype=np.uint8,
+                                       shape=(len(samples), *sample_shape))
+    labels = np.empty(len(samples), dtype=np.int8)
+    participant_ids = np.empty(len(samples), dtype=np.int16)
+    metadata = []
+
+    # The images of all samples in order, so each image has a fixed index in the flattened images array
+    image_paths = [image_path for sample in samples for image_path in sample]
+    flat_images = images.reshape(-1, *IMAGE_SIZE, 3)
+
+    def decode_chunk(start):
+        for i in range(start, min(start + CHUNK_SIZE, len(image_paths))):
+            flat_images[i] = decode_image(image_paths[i])
+
+    # OpenCV releases the GIL while decoding, so threads suffice.
+    # Each task decodes a chunk of images, so single images of EmoHeVRDB-SI are decoded in parallel as well.
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        # Consume the results, so exceptions raised in the workers are not silently dropped
+        list(executor.map(decode_chunk, range(0, len(image_paths), CHUNK_SIZE)))
+
+    for i, sample in enumerate(samples):
+        image_metadata = [parse_image_metadata(image_path.relative_to(set_path)) for image_path in sample]
+        labels[i] = image_metadata[0]['emotion_id']
+        participant_ids[i] = image_metadata[0]['participant_id']
+        metadata.append(image_metadata if sequences else image_metadata[0])
+
+    images.flush()
+    del images
+    np.save(output_path / 'labels.npy', labels)
+    np.save(output_path / 'participant_ids.npy', participant_ids)
+    with open(output_path / 'metadata.json', mode='w', encoding='utf-8') as metadata_file:
+        json.dump(metadata, metadata_file)
+    print(f'Decoded {len(samples)} samples of {set_path} to {output_path}')
+
+
+def build_image_tensors(input_path: Path, output_path: Path, sequences: bool = False, workers: int = None) -> None:
+    """Decodes each set directory (training_set, validation_set, test_set) below input_path separately."""
+    for set_path in sorted(input_path.iterdir()):
+        if set_path.is_dir():
+            build_set_tensors(set_path, output_path / set_path.name, sequences, workers)
+
+
+def load_image_tensors(set_tensors_path: Path) -> dict:
+    """Loads the arrays of a set built by build_set_tensors. images is memory-mapped, i.e., it is not read into memory."""
+    with open(set_tensors_path / 'metadata.json', mode='r', encoding='utf-8') as metadata_file:
+        metadata = json.load(metadata_file)
+    return {
+        'images': np.load(set_tensors_path / 'images.npy', mmap_mode='r'),
+        'labels': np.load(set_tensors_path / 'labels.npy'),
+        'participant_ids': np.load(set_tensors_path / 'participant_ids.npy'),
+        'metadata': metadata,
+    }
+
+
+if __name__ == '__main__':
+    base_directory = Path(r'/media/thor/PortableSSD/emoji-hero-vr-db/dataset/emoji-hero-vr-db')
+    build_image_tensors(base_directory / 'emoji-hero-vr-db-si', base_directory.parent / 'emoji-hero-vr-db-si-tensors')
+    build_image_tensors(base_directory / 'emoji-hero-vr-db-di', base_directory.parent / 'emoji-hero-vr-db-di-tensors',
+                        sequences=True)
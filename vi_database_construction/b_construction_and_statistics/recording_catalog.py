@@ -0,0 +1,153 @@
+import json
+import os
+from collections import namedtuple
+from pathlib import Path
+
+# The original recordings are structured as follows:
+#
+# facial-recordings
+# ├── <participant-id>
+#     ├── Level <level-id>
+#         ├── <emoji-id>-<emotion-name>
+#             ├── <timestamp>.png
+#             ├── <timestamp>-1.png
+#
+# Searching this structure for every single image means listing 147k files again and again.
+# Therefore, we walk it once and persist a catalog that maps
+# (<participant-id>, <timestamp>, <camera-index>) to the level, emoji, emotion and path of the recording.
+# To detect changes, the catalog stores the mtime of every directory it visited.
+# Adding or removing an entry of a directory changes the directory's mtime, which triggers a rebuild.
+
+CATALOG_VERSION = 1
+
+# emoji_dir_timestamps is the ascending list of all timestamps recorded by the same camera in the same emoji directory.
+# All recordings of an emoji directory and camera share the same list object.
+Recording = namedtuple('Recording',
+                       ['participant_id', 'timestamp', 'camera_index', 'level_id', 'emoji_id', 'emotion_name', 'path',
+                        'emoji_dir_timestamps'])
+
+
+def get_default_catalog_path(facial_recordings_path: Path) -> Path:
+    return facial_recordings_path.parent / f'{facial_recordings_path.name}-catalog.json'
+
+
+def parse_recording_name(file_name: str):
+    """Returns (<timestamp>, <camera-index>) for '<timestamp>.png' and '<timestamp>-1.png', else None."""
+    if not file_name.endswith('.png'):
+        return None
+    stem = file_name[:-len('.png')]
+    camera_index = 0
+    if stem.endswith('-1'):
+        stem = stem[:-len('-1')]
+        camera_index = 1
+    if not stem.isdigit():
+        return None
+    return int(stem), camera_index
+
+
+def get_recording_path(emoji_dir_path: Path, timestamp: int, camera_index: int) -> Path:
+    camera_suffix = '' if camera_index == 0 else '-1'
+    return emoji_dir_path / f'{timestamp}{camera_suffix}.png'
+
+
+def scan_facial_recordings(facial_recordings_path: Path) -> dict:
+    """Walks the facial recordings once with os.scandir and returns the catalog's JSON representation."""
+    directory_mtimes = {'.': os.stat(facial_recordings_path).st_mtime_ns}
+    emoji_dirs = []
+
+    with os.scandir(facial_recordings_path) as participant_entries:
+        for participant_entry in participant_entries:
+            if not participant_entry.is_dir():
+                continue
+            directory_mtimes[participant_entry.name] = participant_entry.stat().st_mtime_ns
+
+            with os.scandir(participant_entry.path) as level_entries:
+                for level_entry in level_entries:
+                    if not level_entry.is_dir() or not level_entry.name.startswith('Level'):
+                        continue
+                    level_key = f'{participant_entry.name}/{level_entry.name}'
+                    directory_mtimes[level_key] = level_entry.stat().st_mtime_ns
+
+                    with os.scandir(level_entry.path) as emoji_entries:
+                        for emoji_entry in emoji_entries:
+                            if not emoji_entry.is_dir() or '-' not in emoji_entry.name:
+                                continue
+                            emoji_key = f'{level_key}/{emoji_entry.name}'
+                            directory_mtimes[emoji_key] = emoji_entry.stat().st_mtime_ns
+
+                            with os.scandir(emoji_entry.path) as file_entries:
+                                frames = [parse_recording_name(file_entry.name) for file_entry in file_entries]
+                            emoji_dirs.append({
+                                'participant': participant_entry.name,
+                                'level_dir': level_entry.name,
+                                'emoji_dir': emoji_entry.name,
+                                'frames': sorted(frame for frame in frames if frame is not None),
+                            })
+
+    return {'version': CATALOG_VERSION, 'directory_mtimes': directory_mtimes, 'emoji_dirs': emoji_dirs}
+
+
+def is_catalog_up_to_date(facial_recordings_path: Path, catalog: dict) -> bool:
+    if catalog.get('version') != CATALOG_VERSION:
+        return False
+    for relative_dir, mtime_ns in catalog['directory_mtimes'].items():
+        try:
+            if os.stat(facial_recordings_path / relative_dir).st_mtime_ns != mtime_ns:
+                return False
+        except FileNotFoundError:
+            return False
+    return True
+
+
+def load_catalog_json(facial_recordings_path: Path, catalog_path: Path = None, rebuild: bool = False) -> dict:
+    catalog_path = catalog_path or get_default_catalog_path(facial_recordings_path)
+
+    if not rebuild and catalog_path.exists():
+        with open(catalog_path, mode='r', encoding='utf-8') as catalog_file:
+            catalog = json.load(catalog_file)
+        if is_catalog_up_to_date(facial_recordings_path, catalog):
+            return catalog
+
+    print(f'Building recording catalog of {facial_recordings_path}...')
+    catalog = scan_facial_recordings(facial_recordings_path)
+    tmp_path = catalog_path.with_name(f'{catalog_path.name}.tmp')
+    with open(tmp_path, mode='w', encoding='utf-8') as catalog_file:
+        json.dump(catalog, catalog_file)
+    os.replace(tmp_path, catalog_path)
+    print(f'Saved recording catalog with {len(catalog["emoji_dirs"])} emoji directories to {catalog_path}')
+    return catalog
+
+
+def load_recording_catalog(facial_recordings_path: Path, catalog_path: Path = None, rebuild: bool = False) -> dict:
+    """
+    Returns a dict mapping (<participant-id>, <timestamp>, <camera-index>) to a Recording.
+    <participant-id> is a string as in the directory names, <timestamp> and <camera-index> are integers.
+    """
+    catalog = load_catalog_json(facial_recordings_path, catalog_path, rebuild)
+
+    recordings = {}
+    for emoji_dir in catalog['emoji_dirs']:
+        participant_id = emoji_dir['participant']
+        level_id = emoji_dir['level_dir'].split()[-1]
+        emoji_id, emotion_name = emoji_dir['emoji_dir'].split('-')[:2]
+        emoji_dir_path = facial_recordings_path / participant_id / emoji_dir['level_dir'] / emoji_dir['emoji_dir']
+
+        # The frames are stored sorted by timestamp, so both lists are sorted as well
+        timestamps_per_camera = {0: [], 1: []}
+        for timestamp, camera_index in emoji_dir['frames']:
+            timestamps_per_camera[camera_index].append(timestamp)
+
+        for timestamp, camera_index in emoji_dir['frames']:
+            key = (participant_id, timestamp, camera_index)
+            if key not in recordings:
+                recordings[key] = Recording(participant_id, timestamp, camera_index, level_id, emoji_id, emotion_name,
+                                            get_recording_path(emoji_dir_path, timestamp, camera_index),
+                                            timestamps_per_camera[camera_index])
+
+    return recordings
+
+
+if __name__ == '__main__':
+    facial_recordings_path = Path(r'/media/thor/PortableSSD1/mydata/emojihero/participant-data/facial-recordings')
+    recordings = load_recording_catalog(facial_recordings_path, rebuild=True)
+    print(f'Found {len(recordings)} recordings.')
@@ -1,18 +1,20 @@
-from collections import Counter
 from pathlib import Path
 
+from dataset_catalog import get_default_catalog_path, update_catalog
 
-def count_samples_by_participant(dataset_path):
-    participant_sample_counts = Counter()
-
-    for image_file in dataset_path.rglob('*-0.jpg'):
-        participant_id = int(image_file.stem.split('-')[2])
-        participant_sample_counts[participant_id] += 1
 
-    for participant_id, count in sorted(participant_sample_counts.items()):
+def count_samples_by_participant(dataset_path):
+    """Counts the central-view samples per participant via the dataset catalog (see dataset_catalog.py)."""
+    connection = update_catalog(get_default_catalog_path(dataset_path), dataset_paths=[dataset_path])
+    participant_sample_counts = connection.execute(
+        "SELECT participant_id, COUNT(*) FROM artifacts WHERE dataset = ? AND suffix = '.jpg' AND camera_index = 0 "
+        "GROUP BY participant_id ORDER BY participant_id", (dataset_path.name,)).fetchall()
+    connection.close()
+
+    for participant_id, count in participant_sample_counts:
         print(f'Participant {participant_id}: {count} samples')
 
-    print(f'Found {sum(participant_sample_counts.values())} central-view samples in total!')
+    print(f'Found {sum(count for _, count in participant_sample_counts)} central-view samples in total!')
 
 
 if __name__ == '__main__':
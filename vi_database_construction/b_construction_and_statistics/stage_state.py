@@ -0,0 +1,102 @@
+import json
+import os
+import sqlite3
+from pathlib import Path
+
+import cv2
+
+# The image processing stages (1_crop_images2face.py, 2_resize_images.py, 3_to_jpg.py and
+# 1_to_3_crop_resize_and_convert_images.py) process each image independently.
+# To resume an interrupted run and to only reprocess affected images after a change,
+# each stage records every image it finished in a small SQLite state file next to its output directory:
+# the image's relative path, the mtime and size of its source file and the stage's parameters.
+# An output is up to date if it exists and the recorded source signature and parameters still match.
+# Outputs are written atomically (temporary file + rename), so an interrupted run never leaves a truncated image.
+# Use the state as a context manager, so it is committed and closed even if the run is interrupted.
+# Note that the parameters only cover explicit settings, changes to the code of a stage require rebuild=True.
+
+COMMIT_INTERVAL = 100
+
+
+def get_source_signature(source_path: Path):
+    stat = os.stat(source_path)
+    return stat.st_mtime_ns, stat.st_size
+
+
+def write_bytes_atomically(path: Path, data: bytes) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f'.{path.name}.{os.getpid()}.tmp')
+    with open(tmp_path, mode='wb') as tmp_file:
+        tmp_file.write(data)
+    os.replace(tmp_path, path)
+
+
+def write_image_atomically(path: Path, np_image, params=()) -> None:
+    """Encodes the image according to the suffix of path, like cv2.imwrite, and writes it atomically."""
+    success, encoded_image = cv2.imencode(path.suffix, np_image, list(params))
+    if not success:
+        raise ValueError(f'Could not encode image {path}')
+    write_bytes_atomically(path, encoded_image.tobytes())
+
+
+class StageState:
+    """The finished images of a stage's output directory."""
+
+    def __init__(self, output_path: Path, params: dict, rebuild: bool = False):
+        self.output_path = output_path
+        self.params = json.dumps(params, sort_keys=True)
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(str(output_path.parent / f'{output_path.name}.stage-state.sqlite'))
+        self.connection.execute('CREATE TABLE IF NOT EXISTS outputs ('
+                                'relative_path TEXT PRIMARY KEY, '
+                                'source_mtime_ns INTEGER NOT NULL, '
+                                'source_size INTEGER NOT NULL, '
+                                'params TEXT NOT NULL)')
+        if rebuild:
+            self.connection.execute('DELETE FROM outputs')
+        self.connection.commit()
+        self.source_signatures = {}
+        self.uncommitted = 0
+
+    def get_pending(self, source_paths, input_path: Path, output_suffix: str = None, extra_outputs=()) -> list:
+        """
+        Returns the source paths whose outputs are missing or outdated.
+        output_suffix replaces the suffix of the source path for the output path, e.g., '.jpg' for 3_to_jpg.py.
+        extra_outputs are further (output_path, output_suffix) pairs written along with each output,
+        e.g., the intermediate versions of 1_to_3_crop_resize_and_convert_images.py, which have to exist as well.
+        """
+        finished = {relative_path: (mtime_ns, size, params) for relative_path, mtime_ns, size, params
+                    in self.connection.execute('SELECT * FROM outputs')}
+        outputs = [(self.output_path, output_suffix), *extra_outputs]
+        pending = []
+        for source_path in source_paths:
+            relative_path = source_path.relative_to(input_path)
+            key = relative_path.as_posix()
+            signature = get_source_signature(source_path)
+            self.source_signatures[key] = signature
+            if finished.get(key) != (*signature, self.params) or not all(
+                    (output_path / (relative_path if suffix is None else relative_path.with_suffix(suffix))).exists()
+                    for output_path, suffix in outputs):
+                pending.append(source_path)
+        return pending
+
+    def record(self, source_path: Path, input_path: Path) -> None:
+        """Records that the output of source_path was written. Call get_pending first."""
+        key = source_path.relative_to(input_path).as_posix()
+        self.connection.execute('INSERT OR REPLACE INTO outputs VALUES (?, ?, ?, ?)',
+                                (key, *self.source_signatures[key], self.params))
+        self.uncommitted += 1
+        if self.uncommitted >= COMMIT_INTERVAL:
+            self.connection.commit()
+            self.uncommitted = 0
+
+    def close(self) -> None:
+        self.connection.commit()
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        # Also commits the images recorded before an exception or KeyboardInterrupt, so a rerun skips them
+        self.close()
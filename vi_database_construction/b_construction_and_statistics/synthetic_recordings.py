@@ -0,0 +1,152 @@
+import json
+import shutil
+from pathlib import Path
+
+import cv2
+import numpy as np
+
+from fea_recordings import NUMBER_OF_FEAS
+
+# Fabricates a facial-recordings tree with the structure and timing of the original recordings,
+# so the construction scripts can be run and benchmarked without access to the participant data:
+#
+# facial-recordings
+# ├── <participant-id>
+#     ├── faceexpressions.csv
+#     ├── Level <level-id>
+#         ├── <emoji-id>-<emotion-name>
+#             ├── <timestamp>.png     (central view, 1280x720 BGRA)
+#             ├── <timestamp>-1.png   (side view, same timestamp)
+#
+# faceexpressions.csv contains one row per ~15.9 ms (~62.8 Hz) from the start to the end of each level:
+# <timestamp>;Level <level-id>;;;{"ExpressionWeights": [<63 floats>]}
+# With invalid_payload_rate > 0, that fraction of payloads is truncated, like the invalid rows of participant 7.
+# Images are captured along with every second row (~30 fps, within a few milliseconds of the row),
+# i.e., ~62 per emoji window of ~2 seconds.
+#
+# The images only show a drawn face-like ellipse, so face detection will usually fall back to the central crop.
+# generate_dataset additionally selects one image per emoji window into
+# <set-name>/<emotion-name>/<timestamp>-<participant-id>-<camera-index>.png,
+# which is the input of 0_organize_images.py.
+
+EMOTIONS = ['Anger', 'Disgust', 'Fear', 'Happiness', 'Neutral', 'Sadness', 'Surprise']
+LEVELS = [1, 2, 3, 4]
+FIRST_TIMESTAMP = 1700000000000
+FEA_INTERVAL_MS = 1000 / 62.8
+FEA_ROWS_PER_IMAGE = 2
+
+
+def draw_image(rng, image_size, camera_index):
+    """Returns a BGRA image with a slightly moving face-like ellipse on a gradient background."""
+    width, height = image_size
+    gradient = np.linspace(40, 120, width, dtype=np.uint8)
+    np_image = np.empty((height, width, 4), dtype=np.uint8)
+    np_image[..., :3] = gradient[None, :, None]
+    np_image[..., 3] = 255
+
+    center_x = width // 2 + int(rng.integers(-20, 21)) + (width // 6 if camera_index == 1 else 0)
+    center_y = height // 2 + int(rng.integers(-20, 21))
+    axes = (height // 5, height // 4)
+    cv2.ellipse(np_image, (center_x, center_y), axes, 0, 0, 360, (150, 180, 220, 255), -1)
+    for eye_x in (center_x - axes[0] // 2, center_x + axes[0] // 2):
+        cv2.circle(np_image, (eye_x, center_y - axes[1] // 4), axes[0] // 8, (60, 40, 30, 255), -1)
+    cv2.ellipse(np_image, (center_x, center_y + axes[1] // 2), (axes[0] // 3, axes[1] // 10), 0, 0, 180,
+                (80, 60, 160, 255), 3)
+    return np_image
+
+
+def write_fea_rows(fea_file, rng, level_id, timestamps, invalid_payload_rate):
+    weights = np.round(rng.beta(0.5, 4, (len(timestamps), NUMBER_OF_FEAS)), 6)
+    for timestamp, expression_weights in zip(timestamps, weights):
+        payload = json.dumps({'ExpressionWeights': expression_weights.tolist()})
+        if rng.random() < invalid_payload_rate:
+            payload = payload[:int(rng.integers(1, len(payload)))]
+        fea_file.write(f'{timestamp};Level {level_id};;;{payload}\n')
+
+
+def generate_participant(participant_path, rng, start_timestamp, emoji_dirs_per_level=8,
+                         images_per_window=62, image_size=(1280, 720), invalid_payload_rate=0.0):
+    """
+    Generates the recordings of one participant and returns the emoji windows as
+    (level-id, emoji-id, emotion-name, [<timestamp>, ...]) together with the number of FEA rows.
+    """
+    windows = []
+    fea_rows = 0
+    timestamp = start_timestamp
+    participant_path.mkdir(parents=True, exist_ok=True)
+    with open(participant_path / 'faceexpressions.csv', mode='w', encoding='utf-8', newline='') as fea_file:
+        for level_id in LEVELS:
+            # Plan the windows as indices of the level's FEA rows first
+            level_windows = []
+            fea_index = 0
+            for emoji_id in range(emoji_dirs_per_level):
+                emotion_name = EMOTIONS[int(rng.integers(len(EMOTIONS)))]
+                # Some frames are dropped, so the number of images per window varies slightly
+                image_count = images_per_window - int(rng.integers(0, 3))
+                indices = fea_index + FEA_ROWS_PER_IMAGE * np.arange(image_count)
+                level_windows.append((emoji_id, emotion_name, indices))
+                # Pause between two emojis
+                fea_index = int(indices[-1]) + int(rng.integers(1500, 3000) / FEA_INTERVAL_MS)
+
+            fea_timestamps = timestamp + np.round(np.arange(fea_index) * FEA_INTERVAL_MS
+                                                  + rng.uniform(-1, 1, fea_index)).astype(np.int64)
+            for emoji_id, emotion_name, indices in level_windows:
+                emoji_dir_path = participant_path / f'Level {level_id}' / f'{emoji_id}-{emotion_name}'
+                emoji_dir_path.mkdir(parents=True, exist_ok=True)
+                timestamps = [int(fea_timestamps[index]) + int(rng.integers(-2, 3)) for index in indices]
+                for image_timestamp in timestamps:
+                    for camera_index in (0, 1):
+                        camera_suffix = '' if camera_index == 0 else '-1'
+                        cv2.imwrite(str(emoji_dir_path / f'{image_timestamp}{camera_suffix}.png'),
+                                    draw_image(rng, image_size, camera_index))
+                windows.append((level_id, emoji_id, emotion_name, timestamps))
+
+            write_fea_rows(fea_file, rng, level_id, fea_timestamps, invalid_payload_rate)
+            fea_rows += len(fea_timestamps)
+            # Pause between two levels
+            timestamp = int(fea_timestamps[-1]) + int(rng.integers(30000, 60000))
+    return windows, fea_rows
+
+
+def generate_facial_recordings(output_path, participants=2, emoji_dirs_per_level=8, images_per_window=62,
+                               image_size=(1280, 720), invalid_payload_rate=0.0, seed=0):
+    """
+    Generates the recordings of participants 1 to participants below output_path/facial-recordings
+    and returns {<participant-id>: <emoji windows>} as returned by generate_participant.
+    """
+    facial_recordings_path = output_path / 'facial-recordings'
+    rng = np.random.default_rng(seed)
+    windows = {}
+    for participant_id in range(1, participants + 1):
+        # One session per participant, each on another day
+        start_timestamp = FIRST_TIMESTAMP + (participant_id - 1) * 24 * 60 * 60 * 1000
+        windows[str(participant_id)], fea_rows = generate_participant(
+            facial_recordings_path / str(participant_id), rng, start_timestamp,
+            emoji_dirs_per_level, images_per_window, image_size, invalid_payload_rate)
+        print(f'Generated {len(windows[str(participant_id)])} emoji windows and {fea_rows} FEA rows '
+              f'for participant {participant_id}')
+    return windows
+
+
+def generate_dataset(facial_recordings_path, windows, dataset_path, seed=0):
+    """Selects one image (both views) per emoji window into a training, validation or test set."""
+    rng = np.random.default_rng(seed)
+    set_names = ['training_set', 'validation_set', 'test_set']
+    for participant_id, participant_windows in windows.items():
+        for level_id, emoji_id, emotion_name, timestamps in participant_windows:
+            set_name = set_names[rng.choice(3, p=[0.7, 0.15, 0.15])]
+            # The labeled images are taken from the second half of a window, when the expression is established
+            timestamp = timestamps[int(rng.integers(len(timestamps) // 2, len(timestamps)))]
+            emoji_dir_path = facial_recordings_path / participant_id / f'Level {level_id}' / f'{emoji_id}-{emotion_name}'
+            dest_dir = dataset_path / set_name / emotion_name
+            dest_dir.mkdir(parents=True, exist_ok=True)
+            for camera_index in (0, 1):
+                camera_suffix = '' if camera_index == 0 else '-1'
+                shutil.copyfile(emoji_dir_path / f'{timestamp}{camera_suffix}.png',
+                                dest_dir / f'{timestamp}-{participant_id}-{camera_index}.png')
+
+
+if __name__ == '__main__':
+    output_path = Path('synthetic-emojihero')
+    windows = generate_facial_recordings(output_path, participants=2)
+    generate_dataset(output_path / 'facial-recordings', windows, output_path / 'dataset')
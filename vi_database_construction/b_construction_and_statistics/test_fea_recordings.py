@@ -0,0 +1,55 @@
+import numpy as np
+import pytest
+
+from fea_recordings import (NUMBER_OF_FEAS, FeaRecording, align_to_valid_rows, iter_fea_chunks, iter_json_chunks,
+                            parse_expression_weights)
+
+# Run with python -m pytest in this directory.
+
+
+def fea_row(timestamp, weights):
+    return f'{timestamp};Level 1;;;{{"ExpressionWeights": [{", ".join(weights)}]}}\n'
+
+
+def concatenate_chunks(chunks):
+    chunks = list(chunks)
+    return (np.concatenate([chunk.timestamps for chunk in chunks]),
+            np.concatenate([chunk.weights for chunk in chunks]),
+            sum(chunk.repaired_rows for chunk in chunks),
+            sum(chunk.invalid_rows for chunk in chunks))
+
+
+@pytest.mark.parametrize('payload', ['{"ExpressionWeights": 5}', '{"ExpressionWeights": null}', '[1, 2]',
+                                     '{"ExpressionWeights": [true' + ', 0.1' * (NUMBER_OF_FEAS - 1) + ']}'])
+def test_parse_expression_weights_rejects_other_values(payload):
+    assert parse_expression_weights(payload) is None
+
+
+# A null, string or NaN weight in the first, an inner or the last field of the payload
+@pytest.mark.parametrize('bad_weight', ['null', '"0.5"', 'NaN'])
+@pytest.mark.parametrize('position', [0, 30, NUMBER_OF_FEAS - 1])
+def test_arrow_and_json_decoders_agree_on_invalid_weights(tmp_path, bad_weight, position):
+    rng = np.random.default_rng(position)
+    rows = []
+    for row in range(20):
+        weights = [str(weight) for weight in np.round(rng.random(NUMBER_OF_FEAS), 6)]
+        if row in (3, 11):
+            weights[position] = bad_weight
+        rows.append(fea_row(1700000000000 + 16 * row, weights))
+    csv_file_path = tmp_path / 'faceexpressions.csv'
+    csv_file_path.write_text(''.join(rows), encoding='utf-8')
+
+    timestamps, weights, repaired_rows, invalid_rows = concatenate_chunks(iter_fea_chunks(csv_file_path))
+    json_timestamps, json_weights, json_repaired_rows, json_invalid_rows = concatenate_chunks(
+        iter_json_chunks(csv_file_path))
+
+    np.testing.assert_array_equal(timestamps, json_timestamps)
+    np.testing.assert_array_equal(weights, json_weights)
+    assert (repaired_rows, invalid_rows) == (json_repaired_rows, json_invalid_rows) == (0, 2)
+    # Invalid rows are NaN as a whole, so no partly-NaN row is aligned as valid
+    assert np.isnan(weights[[3, 11]]).all()
+    assert not np.isnan(np.delete(weights, [3, 11], axis=0)).any()
+
+    recording = FeaRecording(timestamps, None, None, weights, repaired_rows, invalid_rows)
+    indices, _ = align_to_valid_rows(recording, timestamps[[3, 11]], 0)
+    np.testing.assert_array_equal(indices, [-1, -1])